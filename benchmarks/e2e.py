@@ -0,0 +1,271 @@
+"""
+Offline end-to-end benchmark of the app with in-memory Firebase and Gemini.
+
+    python -m benchmarks.e2e [--users 10] [--exams-per-user 3] [--requests 500]
+                             [--concurrency 20] [--gemini-latency 2] [--db-latency-ms 5]
+                             [--questions 40] [--output benchmarks/results.json]
+                             [--baseline old.json --tolerance 0.2]
+
+Phases:
+    upload    each user uploads distinct PDFs; the pipeline (queue -> extract -> save ->
+              notify) is timed from POST /upload-pdf until /job-status reports done.
+    routes    concurrent clients hit /dashboard, /exam/{id}, /api/exam/{id}/questions
+              and /job-status for a fixed number of requests each.
+
+Per route it reports p50/p90/p99 latency and requests/sec and writes them, with the
+configuration, to --output. With --baseline it exits non-zero when a route's p99 or
+throughput is worse than the baseline by more than --tolerance.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Settings the app reads at import; a real deployment provides them through .env
+os.environ.setdefault("URL", "http://bench/")
+os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+os.environ.setdefault("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "exam-shuffler-bench-spool"))
+os.environ.setdefault("JOB_QUEUE_SIZE", "1000")  # Every upload of the run is queued at once
+
+
+def percentile(samples: list, q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, seconds: float, ok: bool):
+        self.latencies.append(seconds)
+        if not ok:
+            self.errors += 1
+
+    def summary(self) -> dict:
+        wall = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        ms = [s * 1000 for s in self.latencies]
+        return {
+            "requests": len(ms),
+            "errors": self.errors,
+            "p50_ms": round(percentile(ms, 50), 2),
+            "p90_ms": round(percentile(ms, 90), 2),
+            "p99_ms": round(percentile(ms, 99), 2),
+            "mean_ms": round(statistics.fmean(ms), 2) if ms else 0.0,
+            "rps": round(len(ms) / wall, 1) if wall > 0 else 0.0,
+        }
+
+
+def session_cookie(user_id: str) -> dict:
+    from jose import jwt
+    payload = {
+        "sub": user_id,
+        "email": f"{user_id}@bench.local",
+        "name": f"Bench {user_id}",
+        "exp": datetime.now(timezone.utc) + timedelta(hours=1),
+    }
+    return {"access_token": jwt.encode(payload, os.environ["JWT_SECRET"], algorithm="HS256")}
+
+
+def fake_pdf(size: int, pages: int = 4) -> bytes:
+    """A valid PDF of blank pages, padded to about `size` bytes with random metadata so every upload is distinct."""
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=595, height=842)
+    writer.add_metadata({"/Padding": os.urandom(max(size // 2, 8)).hex()})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+async def run_uploads(client_for, users: list, exams_per_user: int, pdf_size: int, pdf_pages: int,
+                      stats: dict, poll_interval: float) -> list:
+    """Upload and wait for every job. Returns (user_id, exam_id) per created exam."""
+    upload_stats = stats.setdefault("POST /upload-pdf", RouteStats())
+    pipeline_stats = stats.setdefault("pipeline upload->done", RouteStats())
+    upload_stats.started = pipeline_stats.started = time.perf_counter()
+
+    async def one(user_id: str, n: int):
+        client = client_for(user_id)
+        started = time.perf_counter()
+        response = await client.post("/upload-pdf", files={"file": (f"exam-{n}.pdf", fake_pdf(pdf_size, pdf_pages), "application/pdf")})
+        upload_stats.record(time.perf_counter() - started, response.status_code == 200)
+        if response.status_code != 200:
+            return None, None
+        body = response.json()
+        result = body if body.get("status") == "done" else None
+        while result is None:
+            await asyncio.sleep(poll_interval)
+            job = (await client.get(f"/job-status/{body['job_id']}")).json()
+            if job.get("status") == "done":
+                result = job["result"]
+            elif job.get("status") == "error":
+                break
+        pipeline_stats.record(time.perf_counter() - started, result is not None)
+        return user_id, result and result["examId"]
+
+    created = await asyncio.gather(*(one(user, n) for user in users for n in range(exams_per_user)))
+    upload_stats.finished = pipeline_stats.finished = time.perf_counter()
+    return [(user_id, exam_id) for user_id, exam_id in created if exam_id]
+
+
+async def run_route(name: str, make_request, requests: int, concurrency: int, stats: dict):
+    """Send `requests` requests from `concurrency` concurrent clients."""
+    route_stats = stats.setdefault(name, RouteStats())
+    remaining = iter(range(requests))
+
+    async def client_loop():
+        for i in remaining:
+            started = time.perf_counter()
+            try:
+                response = await make_request(i)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            route_stats.record(time.perf_counter() - started, ok)
+
+    route_stats.started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    route_stats.finished = time.perf_counter()
+
+
+async def benchmark(args) -> dict:
+    import httpx
+    from website import app
+    from benchmarks import fakes
+
+    database, gemini = fakes.install(
+        db_latency=args.db_latency_ms / 1000,
+        gemini_latency=args.gemini_latency,
+        questions=args.questions,
+        answer_chars=args.answer_chars,
+    )
+    users = [f"bench-user-{n}" for n in range(args.users)]
+    stats = {}
+    transport = httpx.ASGITransport(app=app)
+    clients = {user: httpx.AsyncClient(transport=transport, base_url="http://bench", cookies=session_cookie(user))
+               for user in users + ["bench-poller"]}
+    try:
+        async with app.router.lifespan_context(app):
+            exams = await run_uploads(clients.__getitem__, users, args.exams_per_user, args.pdf_size,
+                                      args.pdf_pages, stats, args.poll_interval)
+            if not exams:
+                raise SystemExit("No exam was created, nothing to benchmark")
+            # A job whose status is polled; a user of its own so the upload quota is not in the way
+            job_client = clients["bench-poller"]
+            job_id = (await job_client.post("/upload-pdf", files={"file": ("poll.pdf", fake_pdf(1024))})).json()["job_id"]
+
+            def exam_request(i, path):
+                user_id, exam_id = exams[i % len(exams)]
+                params = {"seed": f"{i % args.seeds:x}"}
+                if path:
+                    params.update(offset=10, limit=10)
+                return clients[user_id].get(f"/exam/{exam_id}" if not path else f"/api/exam/{exam_id}/{path}",
+                                            params=params)
+
+            routes = {
+                "GET /dashboard": lambda i: clients[users[i % len(users)]].get("/dashboard"),
+                "GET /exam/{id}": lambda i: exam_request(i, None),
+                "GET /api/exam/{id}/questions": lambda i: exam_request(i, "questions"),
+                "GET /job-status/{id}": lambda i: job_client.get(f"/job-status/{job_id}"),
+            }
+            for name, make_request in routes.items():
+                await run_route(name, make_request, args.requests, args.concurrency, stats)
+    finally:
+        for client in clients.values():
+            await client.aclose()
+
+    return {
+        "routes": {name: route.summary() for name, route in stats.items()},
+        "backend_calls": {"firebase": database.calls, "gemini": gemini.calls},
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a description of every route that regressed beyond tolerance."""
+    regressions = []
+    for name, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(name)
+        if not previous:
+            continue
+        if previous["p99_ms"] and current["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {previous['p99_ms']} -> {current['p99_ms']} ms")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {previous['rps']} -> {current['rps']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--exams-per-user", type=int, default=3, help="At most 6 (the per-user quota)")
+    parser.add_argument("--pdf-size", type=int, default=256 * 1024, help="Bytes per uploaded file")
+    parser.add_argument("--pdf-pages", type=int, default=4, help="Pages per uploaded file (more than GEMINI_CHUNK_PAGES exercises chunking)")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients per route")
+    parser.add_argument("--seeds", type=int, default=50, help="Distinct shuffle seeds used for exam pages")
+    parser.add_argument("--gemini-latency", type=float, default=2.0, help="Seconds per fake Gemini call")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="Milliseconds per fake database call")
+    parser.add_argument("--questions", type=int, default=40, help="Questions per fake exam")
+    parser.add_argument("--answer-chars", type=int, default=80, help="Characters per fake answer")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Seconds between /job-status polls")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results.json"))
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+    args.exams_per_user = min(args.exams_per_user, 6)
+
+    results = asyncio.run(benchmark(args))
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        **results,
+    }
+
+    print(f"{'route':34} {'reqs':>6} {'err':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for name, route in results["routes"].items():
+        print(f"{name:34} {route['requests']:>6} {route['errors']:>5} {route['p50_ms']:>9} "
+              f"{route['p90_ms']:>9} {route['p99_ms']:>9} {route['rps']:>8}")
+    print(f"backend calls: {results['backend_calls']}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+In-memory stand-ins for the Realtime Database and the Gemini client, so the
+app can be benchmarked without network access or credentials.
+
+    from benchmarks import fakes
+    fakes.install(db_latency=0.005, gemini_latency=2.0, questions=40)
+
+install() must run after `website` is imported and before the app starts.
+"""
+import asyncio
+import copy
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+_keys = itertools.count()
+
+
+def _split(path: str) -> list:
+    return [part for part in path.strip("/").split("/") if part]
+
+
+def _clean(value):
+    """Drop None values the way the Realtime Database does."""
+    if isinstance(value, dict):
+        return {k: _clean(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_clean(v) for v in value]
+    return value
+
+
+class FakeDatabase:
+    """
+    A tree of dicts behind one lock, with an optional fixed latency per call
+    (the app calls the database from its storage thread pool, so this blocks
+    a pool thread like a real round-trip would).
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.root = {}
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.calls = 0
+
+    def reference(self, path: str = "/"):
+        return FakeReference(self, path)
+
+    def _wait(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeQuery:
+    """order_by_child(child).equal_to(value).get()"""
+
+    def __init__(self, ref, child: str):
+        self.ref = ref
+        self.child = child
+        self.value = None
+
+    def equal_to(self, value):
+        self.value = value
+        return self
+
+    def get(self):
+        node = self.ref.get() or {}
+        return {key: item for key, item in node.items()
+                if isinstance(item, dict) and self._lookup(item) == self.value}
+
+    def _lookup(self, item):
+        for part in _split(self.child):
+            if not isinstance(item, dict):
+                return None
+            item = item.get(part)
+        return item
+
+
+class FakeReference:
+    """The subset of firebase_admin.db.Reference the app uses."""
+
+    def __init__(self, database: FakeDatabase, path: str):
+        if any(c in path for c in ".$#[]"):
+            raise ValueError(f"Invalid path: {path}")
+        self.database = database
+        self.path = "/".join(_split(path))
+
+    @property
+    def key(self):
+        parts = _split(self.path)
+        return parts[-1] if parts else None
+
+    def child(self, path: str):
+        return FakeReference(self.database, f"{self.path}/{path}")
+
+    def _node(self):
+        node = self.database.root
+        for part in _split(self.path):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _write(self, value):
+        parts = _split(self.path)
+        node = self.database.root
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value is None or value == {}:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = copy.deepcopy(_clean(value))
+
+    def get(self, shallow: bool = False):
+        self.database._wait()
+        with self.database.lock:
+            value = copy.deepcopy(self._node())
+        if shallow and isinstance(value, dict):
+            return {key: True for key in value}
+        return value
+
+    def set(self, value):
+        self.database._wait()
+        with self.database.lock:
+            self._write(value)
+
+    def update(self, values: dict):
+        self.database._wait()
+        with self.database.lock:
+            for key, value in values.items():
+                self.child(key)._write(value)
+
+    def push(self, value=""):
+        ref = self.child(f"-bench{next(_keys):08d}")
+        ref.set(value)
+        return ref
+
+    def delete(self):
+        self.set(None)
+
+    def transaction(self, update):
+        self.database._wait()
+        with self.database.lock:
+            value = update(copy.deepcopy(self._node()))
+            self._write(value)
+            return value
+
+    def order_by_child(self, child: str):
+        return FakeQuery(self, child)
+
+
+class _FakeResponse:
+    def __init__(self, parsed, prompt_tokens: int, cached_tokens: int):
+        self.parsed = parsed
+        self.usage_metadata = SimpleNamespace(prompt_token_count=prompt_tokens,
+                                              cached_content_token_count=cached_tokens)
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self.client = client
+
+    def _usage(self, contents, config) -> tuple:
+        """(prompt tokens, cached tokens) for a request."""
+        text = sum(len(part) for part in contents if isinstance(part, str)) // 4
+        cached = self.client.caches.get(config.get("cached_content")) if config else None
+        cached_tokens = len(cached.system_instruction) // 4 if cached else 0
+        return text + cached_tokens + self.client.pdf_tokens, cached_tokens
+
+    async def count_tokens(self, model, contents):
+        text = contents if isinstance(contents, str) else "".join(part for part in contents if isinstance(part, str))
+        return SimpleNamespace(total_tokens=len(text) // 4)
+
+    async def generate_content(self, model, contents, config=None):
+        self.client.calls += 1
+        await asyncio.sleep(self.client.latency)
+        return _FakeResponse(self.client.build_exam(), *self._usage(contents, config))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        """The exam's JSON in `stream_chunks` fragments spread over the latency; the last one carries the usage."""
+        self.client.calls += 1
+        text = self.client.build_exam().model_dump_json()
+        step = -(-len(text) // self.client.stream_chunks)
+        usage = _FakeResponse(None, *self._usage(contents, config)).usage_metadata
+
+        async def chunks():
+            for start in range(0, len(text), step):
+                await asyncio.sleep(self.client.latency / self.client.stream_chunks)
+                yield SimpleNamespace(text=text[start:start + step],
+                                      usage_metadata=usage if start + step >= len(text) else None)
+        return chunks()
+
+
+class _FakeCaches:
+    """client.aio.caches.create/list, keeping cached contents in the client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, model, config):
+        name = f"cachedContents/bench{next(_keys):08d}"
+        self.client.caches[name] = SimpleNamespace(
+            name=name, model=model, display_name=config.get("display_name"),
+            system_instruction=config.get("system_instruction") or "",
+            expire_time=datetime.now(timezone.utc) + timedelta(seconds=int(config.get("ttl", "3600s")[:-1])),
+        )
+        return self.client.caches[name]
+
+    async def list(self, config=None):
+        async def pages():
+            for cached in list(self.client.caches.values()):
+                yield cached
+        return pages()
+
+
+class FakeGenaiClient:
+    """
+    Answers client.aio.models.generate_content after `latency` seconds with an exam of
+    `questions` questions, each with `answers` answers of `answer_chars` characters;
+    generate_content_stream sends the same exam in `stream_chunks` fragments over `latency`.
+    client.aio.caches keeps cached contents in memory, and responses report prompt tokens
+    (about 4 characters per token) with the cached share, like usage_metadata.
+    """
+
+    def __init__(self, latency: float = 2.0, questions: int = 40, answers: int = 4, answer_chars: int = 80,
+                 pdf_tokens: int = 2000, stream_chunks: int = 20):
+        self.latency = latency
+        self.questions = questions
+        self.answers = answers
+        self.answer_chars = answer_chars
+        self.pdf_tokens = pdf_tokens  # Prompt tokens reported for the PDF part
+        self.stream_chunks = stream_chunks  # Fragments of a streamed response
+        self.calls = 0
+        self.caches = {}  # name -> cached content
+        self.aio = type("Aio", (), {})()
+        self.aio.models = _FakeModels(self)
+        self.aio.caches = _FakeCaches(self)
+
+    def build_exam(self):
+        from website.gimini.instructions import Main, Questions, Answers, TestMeta
+        filler = "x" * self.answer_chars
+        return Main(
+            test_data=TestMeta(test_description="Benchmark Exam", test_time="3:00 Hours"),
+            questions=[
+                Questions(
+                    question_number=n,
+                    question_data=f"Question {n}: {filler}",
+                    answers=[Answers(answer=f"{n}.{a} {filler}") for a in range(self.answers)]
+                )
+                for n in range(1, self.questions + 1)
+            ],
+            status="ok"
+        )
+
+
+def install(db_latency: float = 0.0, gemini_latency: float = 2.0, questions: int = 40,
+            answers: int = 4, answer_chars: int = 80):
+    """
+    Point the app's storage facade and Gemini runner at the fakes.
+    Returns:
+        tuple: (FakeDatabase, FakeGenaiClient)
+    """
+    from website.firebase import storage
+    from website.gimini import runner
+    from website.utils import warmup
+
+    database = FakeDatabase(db_latency)
+    gemini = FakeGenaiClient(gemini_latency, questions, answers, answer_chars)
+    storage.db = database
+    warmup.init_firebase = lambda: database
+    runner._client = gemini
+    runner.prompt_cache.invalidate(runner.prompt_cache.name)
+    return database, gemini
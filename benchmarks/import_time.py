@@ -0,0 +1,72 @@
+"""
+Measure how long `import website` takes in a fresh interpreter and fail when it
+exceeds the budget.
+
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 800] [--top 15]
+
+Each run is a new process with `-X importtime`, so nothing is cached between runs.
+Missing settings get placeholder values: importing the app must not need real
+credentials (Firebase and Gemini are initialized lazily).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLACEHOLDER_ENV = {
+    "URL": "http://127.0.0.1:8000/",
+    "JWT_SECRET": "import-time-benchmark",
+}
+
+
+def measure_once() -> tuple:
+    """Return (total import time in ms, {module: cumulative ms}) for one fresh import."""
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import website"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(f"import website failed:\n{result.stderr[-2000:]}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative) / 1000
+    return modules["website"], modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=800)
+    parser.add_argument("--top", type=int, default=15, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    totals = []
+    slowest = {}
+    for _ in range(args.runs):
+        total, modules = measure_once()
+        totals.append(total)
+        for name, ms in modules.items():
+            slowest.setdefault(name, []).append(ms)
+
+    median = statistics.median(totals)
+    print(f"import website: median {median:.0f} ms, min {min(totals):.0f} ms, max {max(totals):.0f} ms "
+          f"over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    # Top-level packages only (no dots), which is where the time is attributable
+    top = sorted(((statistics.median(v), k) for k, v in slowest.items() if "." not in k and k != "website"),
+                 reverse=True)[:args.top]
+    for ms, name in top:
+        print(f"  {ms:8.1f} ms  {name}")
+    for lazy in ("google.genai", "firebase_admin"):
+        if lazy in slowest:
+            print(f"  warning: {lazy} is imported eagerly")
+    sys.exit(0 if median <= args.budget_ms else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Precision and recall of near-duplicate exam detection on a local corpus.
+
+    python -m benchmarks.near_duplicates [exam.pdf ...] [--exams 40] [--pages 4] [--seed 1]
+                                         [--thresholds 0.6,0.7,0.8,0.85,0.9,0.95]
+
+The originals (the given PDFs and --exams generated exams that share a course
+header) are fingerprinted with text_layer.prepare_document and added to the
+similarity index (firebase/near_duplicates.py, on the in-memory database).
+Then every query document is looked up the way an upload is:
+
+    positives, which should find their original:
+        resaved      rewritten by pypdf with compressed content streams and new metadata
+        watermarked  a "copy for student ..." line stamped on every page
+        reflowed     generated exams only: set in another font size and line width
+        ocr_noise    generated exams only: 1% of the words misspelled by one character,
+                     like an OCR'd re-scan
+        scanned      generated exams only: image-only pages, no text layer
+    negatives, which should match nothing:
+        distinct     other exams of the same course
+        sibling      a re-sit that reuses half of an indexed exam's questions
+
+For each threshold it reports precision (matches that are the right original /
+all matches) and recall (right matches / positives), overall and per kind, plus
+the fingerprint and lookup times.
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import statistics
+import string
+import textwrap
+import time
+import zlib
+
+os.environ.setdefault("URL", "http://bench/")
+os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+
+HEADER = [
+    "Faculty of Exact Sciences - Final Examination",
+    "Duration: 3 hours. Answer all questions. No auxiliary material is allowed.",
+    "Mark exactly one answer for every question on the answer sheet.",
+]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vi", "so", "pe", "da", "gor", "lin", "tex", "mar", "quo", "ber"]
+POSITIVE_KINDS = ("resaved", "watermarked", "reflowed", "ocr_noise", "scanned")
+NEGATIVE_KINDS = ("distinct", "sibling")
+
+
+def make_vocabulary(rng: random.Random, size: int = 3000) -> list:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+
+def make_question(rng: random.Random, vocabulary: list, number: int) -> list:
+    lines = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(18, 30))) + "?"]
+    lines.extend(" ".join(rng.choice(vocabulary) for _ in range(rng.randint(3, 7))) for _ in range(4))
+    return lines
+
+
+def exam_pages(questions: list, pages: int, width: int = 90) -> list:
+    """Lay out questions (lists of lines) over pages, the course header on the first one."""
+    per_page = -(-len(questions) // pages)
+    laid_out = []
+    for page in range(pages):
+        lines = list(HEADER) if page == 0 else []
+        for number, question in enumerate(questions[page * per_page:(page + 1) * per_page], page * per_page + 1):
+            stem, *answers = question
+            lines.extend(textwrap.wrap(f"{number}. {stem}", width))
+            lines.extend(f"{letter}. {answer}" for letter, answer in zip("abcd", answers))
+            lines.append("")
+        laid_out.append(lines)
+    return laid_out
+
+
+def text_pdf(pages: list, font_size: int = 10, watermark: str = None) -> bytes:
+    """A PDF with one Helvetica text page per list of lines."""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for lines in pages:
+        page = writer.add_blank_page(width=595, height=842)
+        if watermark:
+            lines = lines + [watermark]
+        escaped = (line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines)
+        body = " ".join(f"({line}) '" for line in escaped)
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 {font_size} Tf 40 810 Td {font_size + 3} TL {body} ET".encode("latin-1"))
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+        })
+        page[NameObject("/Contents")] = writer._add_object(content)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def scanned_pdf(pages: int) -> bytes:
+    """An image-only PDF of the given page count (what a scanner without OCR produces)."""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject, StreamObject
+
+    writer = PdfWriter()
+    for _ in range(pages):
+        page = writer.add_blank_page(width=595, height=842)
+        width, height = 400, 560
+        image = StreamObject()
+        image._data = zlib.compress(os.urandom(width * height // 8) * 8)
+        image.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Image"),
+            NameObject("/Width"): NumberObject(width),
+            NameObject("/Height"): NumberObject(height),
+            NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+            NameObject("/BitsPerComponent"): NumberObject(8),
+            NameObject("/Filter"): NameObject("/FlateDecode"),
+        })
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/XObject"): DictionaryObject({NameObject("/Im1"): writer._add_object(image)}),
+        })
+        content = DecodedStreamObject()
+        content.set_data(b"q 545 0 0 792 25 25 cm /Im1 Do Q")
+        page[NameObject("/Contents")] = writer._add_object(content)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def resave(file_bytes: bytes) -> bytes:
+    """Rewrite a PDF the way an editor's "save as" does: same text, different bytes."""
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(file_bytes)))
+    for page in writer.pages:
+        page.compress_content_streams()
+    writer.add_metadata({"/Producer": "benchmark re-export", "/ModDate": f"D:{time.strftime('%Y%m%d%H%M%S')}"})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def stamp(file_bytes: bytes, text: str) -> bytes:
+    """Add a line of Helvetica text at the bottom of every page of any PDF."""
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(file_bytes)))
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for page in writer.pages:
+        resources = page.setdefault(NameObject("/Resources"), DictionaryObject()).get_object()
+        fonts = resources.setdefault(NameObject("/Font"), DictionaryObject()).get_object()
+        fonts[NameObject("/FWm")] = font
+        content = DecodedStreamObject()
+        content.set_data(f"BT /FWm 8 Tf 40 20 Td ({text}) Tj ET".encode("latin-1"))
+        contents = page.get("/Contents")
+        existing = list(contents.get_object()) if isinstance(contents.get_object(), ArrayObject) else \
+            ([contents] if contents is not None else [])
+        page[NameObject("/Contents")] = ArrayObject(existing + [writer._add_object(content)])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def misspell(rng: random.Random, questions: list, rate: float) -> list:
+    def noisy(line):
+        words = line.split(" ")
+        for i, word in enumerate(words):
+            if word and rng.random() < rate:
+                position = rng.randrange(len(word))
+                words[i] = word[:position] + rng.choice(string.ascii_lowercase) + word[position + 1:]
+        return " ".join(words)
+    return [[noisy(line) for line in question] for question in questions]
+
+
+def build_corpus(files: list, exams: int, pages: int, seed: int) -> tuple:
+    """
+    Returns:
+        tuple: (originals {name: bytes}, queries [(kind, expected original or None, bytes)])
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    originals, queries = {}, []
+    for path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        name = os.path.basename(path)
+        originals[name] = data
+        queries.append(("resaved", name, resave(data)))
+        queries.append(("watermarked", name, stamp(data, f"Copy for student {rng.randint(10000, 99999)}")))
+
+    per_exam = pages * 4
+    generated = []
+    for number in range(exams):
+        questions = [make_question(rng, vocabulary, i) for i in range(per_exam)]
+        name = f"exam-{number:03d}"
+        generated.append((name, questions))
+        data = text_pdf(exam_pages(questions, pages))
+        originals[name] = data
+        queries.append(("resaved", name, resave(data)))
+        queries.append(("watermarked", name, text_pdf(exam_pages(questions, pages),
+                                                       watermark=f"Copy for student {rng.randint(10000, 99999)}")))
+        queries.append(("reflowed", name, text_pdf(exam_pages(questions, pages, width=70), font_size=9)))
+        queries.append(("ocr_noise", name, text_pdf(exam_pages(misspell(rng, questions, 0.01), pages))))
+        queries.append(("scanned", name, scanned_pdf(pages)))
+
+    for _ in range(exams):
+        questions = [make_question(rng, vocabulary, i) for i in range(per_exam)]
+        queries.append(("distinct", None, text_pdf(exam_pages(questions, pages))))
+        _, base = rng.choice(generated)
+        reused = rng.sample(base, per_exam // 2) + questions[:per_exam - per_exam // 2]
+        rng.shuffle(reused)
+        queries.append(("sibling", None, text_pdf(exam_pages(reused, pages))))
+    return originals, queries
+
+
+def fingerprint_of(file_bytes: bytes):
+    from website.gimini.text_layer import prepare_document
+    return prepare_document(file_bytes, 0, 0, text_layer=False, with_fingerprint=True)["fingerprint"]
+
+
+async def evaluate(originals: dict, queries: list, thresholds: list) -> dict:
+    import hashlib
+    from benchmarks import fakes
+    from website.firebase.near_duplicates import index_fingerprint, find_near_duplicate
+
+    fakes.install()
+    fingerprint_ms, lookup_ms = [], []
+    names = {}  # file hash -> original name
+    for name, data in originals.items():
+        started = time.perf_counter()
+        fingerprint = fingerprint_of(data)
+        fingerprint_ms.append((time.perf_counter() - started) * 1000)
+        if fingerprint:
+            file_hash = hashlib.sha256(data).hexdigest()
+            names[file_hash] = name
+            await index_fingerprint(file_hash, fingerprint)
+
+    scored = []  # (kind, expected, matched name, similarity)
+    for kind, expected, data in queries:
+        started = time.perf_counter()
+        fingerprint = fingerprint_of(data)
+        fingerprint_ms.append((time.perf_counter() - started) * 1000)
+        match = None
+        if fingerprint:
+            started = time.perf_counter()
+            match = await find_near_duplicate(fingerprint, exclude=hashlib.sha256(data).hexdigest(), threshold=0.0)
+            lookup_ms.append((time.perf_counter() - started) * 1000)
+        scored.append((kind, expected, names.get(match[0]) if match else None, match[1] if match else 0.0))
+
+    report = {}
+    for threshold in thresholds:
+        per_kind = {kind: {"right": 0, "wrong": 0, "total": 0} for kind in POSITIVE_KINDS + NEGATIVE_KINDS}
+        for kind, expected, matched, similarity in scored:
+            counts = per_kind[kind]
+            counts["total"] += 1
+            if matched is not None and similarity >= threshold:
+                counts["right" if matched == expected else "wrong"] += 1
+        right = sum(counts["right"] for counts in per_kind.values())
+        wrong = sum(counts["wrong"] for counts in per_kind.values())
+        positives = sum(per_kind[kind]["total"] for kind in POSITIVE_KINDS)
+        report[threshold] = {
+            "precision": right / (right + wrong) if right + wrong else 1.0,
+            "recall": right / positives if positives else 0.0,
+            "per_kind": per_kind,
+        }
+    return {
+        "thresholds": report,
+        "fingerprint_ms": statistics.median(fingerprint_ms),
+        "lookup_ms": statistics.median(lookup_ms) if lookup_ms else 0.0,
+        "similarity": {kind: [round(similarity, 2) for k, _, _, similarity in scored if k == kind]
+                       for kind in POSITIVE_KINDS + NEGATIVE_KINDS},
+    }
+
+
+def print_report(result: dict, documents: int, queries: int):
+    print(f"{documents} indexed documents, {queries} queries; median fingerprint "
+          f"{result['fingerprint_ms']:.1f} ms, lookup {result['lookup_ms']:.2f} ms")
+    for kind, values in result["similarity"].items():
+        if values:
+            print(f"  {kind:12} similarity to best candidate: median {statistics.median(values):.2f}, "
+                  f"min {min(values):.2f}, max {max(values):.2f}")
+    kinds = POSITIVE_KINDS + NEGATIVE_KINDS
+    print(f"\n{'threshold':>9} {'precision':>9} {'recall':>7}  " + " ".join(f"{kind:>11}" for kind in kinds))
+    for threshold, row in result["thresholds"].items():
+        cells = []
+        for kind in kinds:
+            counts = row["per_kind"][kind]
+            matched = counts["right"] if kind in POSITIVE_KINDS else counts["wrong"]
+            cells.append(f"{matched:>5}/{counts['total']:<5}")
+        print(f"{threshold:>9.2f} {row['precision']:>9.3f} {row['recall']:>7.3f}  " + " ".join(cells))
+    print("\nPositive kinds count right matches, negative kinds count (wrong) matches.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Exam PDFs to add to the generated corpus")
+    parser.add_argument("--exams", type=int, default=40, help="Generated exams")
+    parser.add_argument("--pages", type=int, default=4, help="Pages per generated exam")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--thresholds", default="0.6,0.7,0.8,0.85,0.9,0.95")
+    args = parser.parse_args()
+
+    originals, queries = build_corpus(args.files, args.exams, args.pages, args.seed)
+    thresholds = [float(value) for value in args.thresholds.split(",")]
+    result = asyncio.run(evaluate(originals, queries, thresholds))
+    print_report(result, len(originals), len(queries))
+
+
+if __name__ == "__main__":
+    main()
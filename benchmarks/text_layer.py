@@ -0,0 +1,160 @@
+"""
+Compare sending exams to Gemini as PDF with sending the local text layer.
+
+    python -m benchmarks.text_layer [exam.pdf ...] [--pages 12] [--scanned 2] [--runs 5] [--live]
+
+Without files it generates an exam of --pages born-digital pages, --scanned of
+which are image-only. For each document and path ("pdf": every page as PDF, the
+old behaviour; "text": text_layer.prepare_document) it reports:
+    prepare ms       local parsing time (median of --runs)
+    payload KB       bytes sent to Gemini
+    est. tokens      estimated input tokens: 258 per PDF page (Gemini's document
+                     rate) plus about 4 characters per text token
+With --live (needs GIMINI_API_KEY) each path is also extracted once by Gemini,
+adding the call latency, the prompt tokens reported by the API and the number of
+questions found, so the text path can be checked for quality as well as cost.
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+import zlib
+
+os.environ.setdefault("URL", "http://bench/")
+os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+
+PDF_PAGE_TOKENS = 258
+CHARS_PER_TOKEN = 4
+
+
+def sample_exam(pages: int, scanned: int) -> bytes:
+    """A PDF of `pages` pages of numbered questions set in Helvetica, the last `scanned` of them image-only."""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject, StreamObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    question = 1
+    for number in range(pages):
+        page = writer.add_blank_page(width=595, height=842)
+        content = DecodedStreamObject()
+        if number < pages - scanned:
+            lines = []
+            for _ in range(4):
+                lines.append(f"Question {question}: A particle moves along a straight line with velocity v(t) = 3t^2 - {question}t.")
+                lines.append("Which of the following is the displacement between t = 0 and t = 2 seconds?")
+                lines.extend(f"{letter}. {question * 2 + i} meters" for i, letter in enumerate("abcd"))
+                lines.append("")
+                question += 1
+            text = " ".join(f"({line}) '" for line in lines)
+            content.set_data(f"BT /F1 11 Tf 50 800 Td 16 TL {text} ET".encode())
+            page[NameObject("/Resources")] = DictionaryObject({
+                NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+            })
+        else:
+            width, height = 850, 1200  # A grey scan at about 100 dpi
+            image = StreamObject()
+            image._data = zlib.compress(os.urandom(width * height // 8) * 8)
+            image.update({
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Image"),
+                NameObject("/Width"): NumberObject(width),
+                NameObject("/Height"): NumberObject(height),
+                NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+                NameObject("/BitsPerComponent"): NumberObject(8),
+                NameObject("/Filter"): NameObject("/FlateDecode"),
+            })
+            page[NameObject("/Resources")] = DictionaryObject({
+                NameObject("/XObject"): DictionaryObject({NameObject("/Im1"): writer._add_object(image)}),
+            })
+            content.set_data(b"q 545 0 0 792 25 25 cm /Im1 Do Q")
+        page[NameObject("/Contents")] = writer._add_object(content)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def measure_path(file_bytes: bytes, text_layer: bool, runs: int) -> dict:
+    from pypdf import PdfReader
+    from website.gimini.text_layer import prepare_document
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        document = prepare_document(file_bytes, 0, 0, text_layer)
+        timings.append(time.perf_counter() - started)
+    parts = document["chunks"][0][2]
+    tokens = 0
+    for kind, data in parts:
+        if kind == "pdf":
+            tokens += len(PdfReader(io.BytesIO(data)).pages) * PDF_PAGE_TOKENS
+        else:
+            tokens += len(data) // CHARS_PER_TOKEN
+    return {
+        "parts": parts,
+        "text_pages": document["text_pages"],
+        "prepare_ms": statistics.median(timings) * 1000,
+        "payload_kb": sum(len(data) for _, data in parts) / 1024,
+        "est_tokens": tokens,
+    }
+
+
+async def extract_live(parts: list) -> dict:
+    from website.gimini import runner
+    prompt_before = runner.GEMINI_TOKENS.value(kind="prompt")
+    started = time.perf_counter()
+    result = await runner.Gimini_Proccess(b"").extract(parts)
+    return {
+        "latency_s": time.perf_counter() - started,
+        "prompt_tokens": runner.GEMINI_TOKENS.value(kind="prompt") - prompt_before,
+        "questions": len(result.questions) if result and result.questions else 0,
+    }
+
+
+async def compare(documents: list, runs: int, live: bool):
+    header = f"{'document':40} {'path':5} {'text pages':>10} {'prepare ms':>11} {'payload KB':>11} {'est. tokens':>12}"
+    if live:
+        header += f" {'latency s':>10} {'tokens':>8} {'questions':>10}"
+    print(header)
+    for name, file_bytes in documents:
+        for path, text_layer in (("pdf", False), ("text", True)):
+            result = measure_path(file_bytes, text_layer, runs)
+            line = (f"{name[:40]:40} {path:5} {result['text_pages']:>10} {result['prepare_ms']:>11.1f} "
+                    f"{result['payload_kb']:>11.1f} {result['est_tokens']:>12}")
+            if live:
+                extracted = await extract_live(result["parts"])
+                line += f" {extracted['latency_s']:>10.1f} {extracted['prompt_tokens']:>8} {extracted['questions']:>10}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Exam PDFs; a generated exam when omitted")
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--scanned", type=int, default=2, help="Image-only pages in the generated exam")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="Also extract each path with Gemini")
+    args = parser.parse_args()
+    if args.live and not os.environ.get("GIMINI_API_KEY"):
+        sys.exit("--live needs GIMINI_API_KEY")
+
+    if args.files:
+        documents = []
+        for path in args.files:
+            with open(path, "rb") as f:
+                documents.append((os.path.basename(path), f.read()))
+    else:
+        documents = [(f"generated ({args.pages} pages, {args.scanned} scanned)", sample_exam(args.pages, args.scanned))]
+
+    asyncio.run(compare(documents, args.runs, args.live))
+
+
+if __name__ == "__main__":
+    main()
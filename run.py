@@ -1,5 +1,29 @@
 from website import app
+import os
+
+APP_ENV = os.environ.get("APP_ENV", "development")  # production runs several workers without reload
+HOST = os.environ.get("HOST", "127.0.0.1")
+PORT = int(os.environ.get("PORT", "8000"))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1)))  # Worker processes in production
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("run:app", host="127.0.0.1", port=8000, reload=True)
+    if APP_ENV == "production":
+        if WEB_CONCURRENCY > 1:
+            # Workers spawned below inherit the environment, so they all share one SQLite bus
+            os.environ.setdefault("NOTIFY_BACKEND", "sqlite")
+            if os.environ["NOTIFY_BACKEND"] == "memory":
+                raise SystemExit("NOTIFY_BACKEND=memory only works with WEB_CONCURRENCY=1")
+            print(f"Starting {WEB_CONCURRENCY} workers with NOTIFY_BACKEND={os.environ['NOTIFY_BACKEND']}")
+        uvicorn.run(
+            "run:app",
+            host=HOST,
+            port=PORT,
+            workers=WEB_CONCURRENCY,
+            loop="uvloop",
+            http="httptools",
+            proxy_headers=True,
+            access_log=False
+        )
+    else:
+        uvicorn.run("run:app", host=HOST, port=PORT, reload=True)
@@ -0,0 +1,5 @@
+import os
+
+# Settings the app reads at import; a real deployment provides them through .env
+os.environ.setdefault("URL", "http://test/")
+os.environ.setdefault("JWT_SECRET", "test-secret")
@@ -0,0 +1,54 @@
+import pytest
+
+from website.utils import cache
+from website.utils.cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_the_ttl(clock):
+    entries = TTLCache(maxsize=10, ttl=5)
+    entries.set("a", 1)
+    clock[0] += 4.9
+    assert entries.get("a") == 1
+    clock[0] += 0.1
+    assert entries.get("a") is None
+    assert len(entries) == 0
+    assert entries.stats()["hits"] == 1 and entries.stats()["misses"] == 1
+
+
+def test_per_entry_ttl(clock):
+    entries = TTLCache(maxsize=10, ttl=5)
+    entries.set("short", 1, ttl=1)
+    entries.set("long", 2)
+    clock[0] += 2
+    assert entries.get("short", "missing") == "missing"
+    assert entries.get("long") == 2
+
+
+def test_least_recently_used_is_evicted(clock):
+    entries = TTLCache(maxsize=2, ttl=60)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")  # b is now the least recently used
+    entries.set("c", 3)
+    assert entries.get("b") is None
+    assert entries.get("a") == 1 and entries.get("c") == 3
+    assert entries.stats()["evictions"] == 1
+
+
+def test_set_refreshes_and_pop_invalidates(clock):
+    entries = TTLCache(maxsize=2, ttl=5)
+    entries.set("a", 1)
+    clock[0] += 4
+    entries.set("a", 2)
+    clock[0] += 4
+    assert entries.get("a") == 2
+    entries.pop("a")
+    entries.pop("missing")
+    assert entries.get("a") is None
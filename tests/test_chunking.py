@@ -0,0 +1,54 @@
+from website.gimini.chunking import merge_results
+from website.gimini.instructions import Answers, Main, Questions, TestMeta as ExamMeta
+
+
+def question(number: int, text: str, answers: list) -> Questions:
+    return Questions(question_number=number, question_data=text, answers=[Answers(answer=a) for a in answers])
+
+
+def chunk(*questions) -> Main:
+    return Main(test_data=ExamMeta(test_description="Exam", test_time="3:00 Hours"),
+                questions=list(questions), status="ok")
+
+
+STEM = "Which of the following statements is correct?"
+
+
+def test_repeated_stem_outside_the_overlap_is_kept():
+    first = chunk(
+        question(1, STEM, ["a", "b", "c", "d"]),
+        question(2, "What is 2 + 2?", ["3", "4", "5"]),
+        question(3, "Boundary question", ["x", "y", "z"]),
+    )
+    second = chunk(
+        question(3, "Boundary question", ["x", "y", "z"]),  # Read again from the overlap page
+        question(4, STEM, ["e", "f", "g", "h", "i"]),
+    )
+    merged = merge_results([first, second])
+
+    assert [q.question_data for q in merged.questions] == [STEM, "What is 2 + 2?", "Boundary question", STEM]
+    assert [a.answer for a in merged.questions[0].answers] == ["a", "b", "c", "d"]
+    assert [a.answer for a in merged.questions[3].answers] == ["e", "f", "g", "h", "i"]
+    assert [q.question_number for q in merged.questions] == [1, 2, 3, 4]
+
+
+def test_question_cut_at_the_chunk_end_keeps_the_complete_copy():
+    first = chunk(
+        question(1, "First question", ["a", "b"]),
+        question(2, "A question that continues on the next", ["a", "b"]),
+    )
+    second = chunk(
+        question(2, "A question that continues on the next page", ["a", "b", "c", "d"]),
+        question(3, "Third question", ["a", "b"]),
+    )
+    merged = merge_results([first, second])
+
+    assert len(merged.questions) == 3
+    assert merged.questions[1].question_data == "A question that continues on the next page"
+    assert len(merged.questions[1].answers) == 4
+
+
+def test_same_stem_with_different_answers_in_the_overlap_is_not_merged():
+    first = chunk(question(1, STEM, ["a", "b"]))
+    second = chunk(question(1, STEM, ["c", "d"]))
+    assert len(merge_results([first, second]).questions) == 2
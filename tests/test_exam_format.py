@@ -0,0 +1,53 @@
+from website.firebase.exam_format import EXAM_SCHEMA_VERSION, blob_v1_to_v2, exam_data_from_blob, question_v1_to_v2
+
+
+def v1_question(number: int, answers: list, correct) -> dict:
+    return {
+        "question_number": number,
+        "question_data": f"Question {number}",
+        "answers": [{"answer": answer} for answer in answers],
+        "correct_answer": {"answer": correct}
+    }
+
+
+def test_question_keeps_answer_order_and_indexes_the_correct_answer():
+    assert question_v1_to_v2(v1_question(3, ["a", "b", "c", "d"], "c")) == {
+        "question_number": 3,
+        "question_data": "Question 3",
+        "answers": ["a", "b", "c", "d"],
+        "correct_index": 2
+    }
+
+
+def test_question_with_missing_or_unknown_correct_answer_falls_back_to_the_first():
+    missing = v1_question(1, ["a", "b"], None)
+    del missing["correct_answer"]
+    assert question_v1_to_v2(missing)["correct_index"] == 0
+    assert question_v1_to_v2(v1_question(1, ["a", "b"], "z"))["correct_index"] == 0
+
+
+def test_question_with_plain_string_answers():
+    question = {"question_number": 1, "question_data": "Q", "answers": ["a", "b"], "correct_answer": {"answer": "b"}}
+    assert question_v1_to_v2(question)["answers"] == ["a", "b"]
+    assert question_v1_to_v2(question)["correct_index"] == 1
+
+
+def test_blob_round_trips_to_the_data_readers_expect():
+    data = {"test_data": {"test_description": "Exam", "test_time": "2:00"},
+            "questions": [v1_question(1, ["a", "b"], "b"), v1_question(2, ["x", "y", "z"], "x")]}
+    blob = blob_v1_to_v2(data)
+
+    assert blob["schema_version"] == EXAM_SCHEMA_VERSION
+    assert blob["meta"] == data["test_data"]
+    assert [q["correct_index"] for q in blob["questions"]] == [1, 0]
+    assert exam_data_from_blob(blob) == {
+        "schema_version": EXAM_SCHEMA_VERSION,
+        "test_data": data["test_data"],
+        "questions": blob["questions"]
+    }
+
+
+def test_empty_v1_data_and_legacy_blobs():
+    assert blob_v1_to_v2({}) == {"schema_version": EXAM_SCHEMA_VERSION, "meta": {}, "questions": []}
+    legacy = {"data": {"questions": [v1_question(1, ["a"], "a")]}}
+    assert exam_data_from_blob(legacy) is legacy["data"]
@@ -0,0 +1,46 @@
+from website.utils.shuffle import shuffle_questions, valid_seed
+
+SEED = "5eed"
+
+
+def exam(count: int) -> list:
+    return [{"question_number": n, "question_data": f"Q{n}", "answers": [f"{n}-{a}" for a in "abcde"],
+             "correct_index": n % 5}
+            for n in range(count)]
+
+
+def test_correct_index_follows_the_correct_answer():
+    questions = exam(30)
+    for original, shuffled in zip(questions, shuffle_questions(questions, SEED)):
+        assert sorted(shuffled["answers"]) == sorted(original["answers"])
+        assert shuffled["answers"][shuffled["correct_index"]] == original["answers"][original["correct_index"]]
+
+
+def test_pages_match_the_whole_exam():
+    questions = exam(25)
+    whole = shuffle_questions(questions, SEED)
+    pages = []
+    for offset in range(0, len(questions), 10):
+        pages += shuffle_questions(questions[offset:offset + 10], SEED, start=offset)
+    assert pages == whole
+
+
+def test_same_seed_same_order_and_stored_questions_untouched():
+    questions = exam(10)
+    stored = [dict(q, answers=list(q["answers"])) for q in questions]
+    assert shuffle_questions(questions, SEED) == shuffle_questions(questions, SEED)
+    assert shuffle_questions(questions, SEED) != shuffle_questions(questions, "0ther")
+    assert questions == stored
+
+
+def test_questions_without_a_valid_correct_index():
+    shuffled = shuffle_questions([{"answers": ["a", "b"]}, {"answers": ["a", "b"], "correct_index": 7}], SEED)
+    assert "correct_index" not in shuffled[0]
+    assert shuffled[1]["correct_index"] == 7
+
+
+def test_valid_seed():
+    assert valid_seed("0123abcd")
+    assert not valid_seed("XYZ")
+    assert not valid_seed("0" * 17)
+    assert not valid_seed(None)
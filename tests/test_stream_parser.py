@@ -0,0 +1,64 @@
+import json
+import random
+
+from website.gimini.stream_parser import QuestionStreamParser
+
+RESPONSE = {
+    "test_data": {"test_description": "Exam {2024} \"A\"", "test_time": "3:00"},
+    "questions": [
+        {"question_number": 1, "question_data": "What does print(\"}\") output?",
+         "answers": [{"answer": "}"}, {"answer": "{"}]},
+        {"question_number": 2, "question_data": "Path C:\\temp\\ and [brackets]",
+         "answers": [{"answer": "a \\\" b"}, {"answer": "]"}]},
+        {"question_number": 3, "question_data": "Nested {\"k\": [1, 2]} text",
+         "answers": [{"answer": "x"}]},
+    ],
+    "status": "ok"
+}
+
+
+def feed_all(text: str, sizes) -> list:
+    parser = QuestionStreamParser()
+    completed = []
+    position = 0
+    for size in sizes:
+        completed += parser.feed(text[position:position + size])
+        position += size
+    completed += parser.feed(text[position:])
+    assert parser.text == text
+    return completed
+
+
+def expected() -> list:
+    return [("test_data", RESPONSE["test_data"])] + [("question", q) for q in RESPONSE["questions"]]
+
+
+def test_whole_response_in_one_fragment():
+    assert feed_all(json.dumps(RESPONSE), []) == expected()
+
+
+def test_one_character_at_a_time():
+    text = json.dumps(RESPONSE, indent=2)
+    assert feed_all(text, [1] * len(text)) == expected()
+
+
+def test_random_fragments():
+    text = json.dumps(RESPONSE)
+    rng = random.Random(7)
+    for _ in range(50):
+        sizes = [rng.randint(1, 40) for _ in range(len(text) // 5)]
+        assert feed_all(text, sizes) == expected()
+
+
+def test_questions_are_returned_as_soon_as_they_close():
+    text = json.dumps(RESPONSE)
+    cut = text.index('{"question_number": 2')
+    parser = QuestionStreamParser()
+    first = parser.feed(text[:cut])
+    assert [kind for kind, _ in first] == ["test_data", "question"]
+    assert [item["question_number"] for _, item in parser.feed(text[cut:])] == [2, 3]
+
+
+def test_questions_key_inside_a_string_is_ignored():
+    text = json.dumps({"test_data": {"test_description": "\"questions\": [{\"a\": 1}]"}, "questions": []})
+    assert feed_all(text, [3] * len(text)) == [("test_data", {"test_description": "\"questions\": [{\"a\": 1}]"})]
@@ -1,15 +1,46 @@
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from website.utils.job_queue import job_queue
+    from website.utils.notify import bus
+    from website.utils.http_client import get_http_client, close_http_client
+    from website.gimini.text_layer import shutdown_pool
+    from website.utils.warmup import warm_clients
+    get_http_client()  # One pooled client for the app's lifetime
+    # Firebase and Gemini are created lazily; warm them in the background so startup stays fast
+    app.state.warmup = asyncio.create_task(warm_clients())
+    await bus.start()
+    await job_queue.start()
+    yield
+    app.state.warmup.cancel()
+    await job_queue.stop()
+    await bus.stop()
+    await close_http_client()
+    shutdown_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+from website.utils.upload_file import UploadSizeLimitMiddleware, MAX_FILE_SIZE, MAX_REQUEST_OVERHEAD, BATCH_MAX_FILES
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/upload-pdf"])
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/upload-pdfs"],
+                   max_body_size=BATCH_MAX_FILES * (MAX_FILE_SIZE + MAX_REQUEST_OVERHEAD))
+app.add_middleware(GZipMiddleware, minimum_size=1024)  # Exam pages and question pages are mostly repetitive JSON
+
+from website.utils.metrics import RequestMetricsMiddleware
+app.add_middleware(RequestMetricsMiddleware)  # Outermost, so latency includes compression
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-connections = {}
 
 
 
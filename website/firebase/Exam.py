@@ -1,14 +1,144 @@
-from . import db
+from .storage import reference
+from .exam_format import EXAM_SCHEMA_VERSION, exam_data_from_blob
+from .near_duplicates import index_fingerprint, remove_fingerprint, find_near_duplicate
+from ..utils.cache import TTLCache
+from ..utils.notify import bus
+from ..utils import metrics
+import asyncio
+import json
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 
 MAX_EXAMS = 6  # Maximum number of exams per user
+EXAM_CACHE_SIZE = int(os.environ.get("EXAM_CACHE_SIZE", "512"))  # Entries per cache
+EXAM_CACHE_TTL = int(os.environ.get("EXAM_CACHE_TTL", "600"))  # Seconds
+EXAM_CACHE_CHANNEL = "exam-cache"  # Bus key of exam cache invalidations, which every worker applies
+
+# Read-through caches in front of GetExamFromDB, invalidated by every write below in every worker
+exam_summaries_cache = TTLCache(EXAM_CACHE_SIZE, EXAM_CACHE_TTL)  # user_id -> exam summaries
+exam_details_cache = TTLCache(EXAM_CACHE_SIZE, EXAM_CACHE_TTL)  # exam_id -> exam with data
+metrics.watch_cache("exam_summaries", exam_summaries_cache)
+metrics.watch_cache("exam_details", exam_details_cache)
+
+
+def exam_cache_stats() -> dict:
+    """Return hit/miss counters of the exam caches."""
+    return {
+        "exam_summaries": exam_summaries_cache.stats(),
+        "exam_details": exam_details_cache.stats()
+    }
+
+
+def drop_cached_exams(user_id: str, exam_id: str = None):
+    exam_summaries_cache.pop(user_id)
+    if exam_id:
+        exam_details_cache.pop(exam_id)
+
+
+async def invalidate_user_exams(user_id: str, exam_id: str = None):
+    """
+    Drop the cached exam summaries of a user (and the details of `exam_id`) after a write,
+    here and, through the notification bus, in the other workers.
+    """
+    drop_cached_exams(user_id, exam_id)
+    try:
+        await bus.publish(EXAM_CACHE_CHANNEL, json.dumps({"user_id": user_id, "exam_id": exam_id}))
+    except Exception:
+        # The write succeeded; other workers drop their copies when the entries expire
+        logger.exception("Could not publish the exam cache invalidation of user %s", user_id)
+
 
+def on_bus_message(key: str, message: str):
+    if key == EXAM_CACHE_CHANNEL:
+        invalidation = json.loads(message)
+        drop_cached_exams(invalidation["user_id"], invalidation.get("exam_id"))
+
+
+bus.on_remote_message(on_bus_message)
 
 
 def get_exams_ref():
     """Return the exams reference safely after initialization."""
-    return db.reference("exams")
+    return reference("exams")
+
+
+def get_exam_index_ref():
+    """Return the exam_id -> owner index reference."""
+    return reference("exam_index")
+
+
+async def index_exam(exam_id: str, user_id: str):
+    """Record which user owns an exam so it can be fetched with a single targeted read."""
+    await get_exam_index_ref().child(exam_id).set({
+        "user_id": user_id,
+        "path": f"exams/{user_id}/{exam_id}"
+    })
+
+
+def get_exam_blobs_ref():
+    """Return the shared exam_blobs reference (extracted exams stored once per file_hash)."""
+    return reference("exam_blobs")
+
+
+async def acquire_exam_blob(file_hash: str, create: bool = False) -> bool:
+    """
+    Add a reference to a shared exam blob.
+    Args:
+        file_hash (str): Hash of the exam file (the blob key).
+        create (bool): Start counting from zero when the blob has no references yet.
+    Returns:
+        bool: True if a reference was taken, False if the blob does not exist.
+    """
+    def increment(count):
+        if not count and not create:
+            return count  # Missing or being garbage-collected
+        return (count or 0) + 1
+
+    return bool(await get_exam_blobs_ref().child(file_hash).child("ref_count").transaction(increment))
+
+
+async def release_exam_blob(file_hash: str):
+    """Drop a reference to a shared exam blob and delete the blob when it is no longer used."""
+    blob_ref = get_exam_blobs_ref().child(file_hash)
+    remaining = await blob_ref.child("ref_count").transaction(lambda count: max((count or 0) - 1, 0))
+    if not remaining:
+        await blob_ref.delete()
+        await remove_fingerprint(file_hash)
+
+
+def get_exam_summaries_ref():
+    """Return the compact per-user exam summaries reference (what the dashboard and upload checks need)."""
+    return reference("exam_summaries")
+
+
+async def add_exam_summary(user_id: str, exam_id: str, exam_name: str, file_hash: str,
+                           question_count: int = 0, status: str = "ready"):
+    """Record a saved exam in the user's summary."""
+    await get_exam_summaries_ref().child(user_id).child(exam_id).set({
+        "exam_name": exam_name,
+        "file_hash": file_hash,
+        "question_count": question_count,
+        "status": status
+    })
+
+
+def get_partial_exams_ref():
+    """Return the partial exams reference (the questions extracted so far, per exam_id)."""
+    return reference("partial_exams")
+
+
+def exam_entry(exam_name: str, file_hash: str, user_email: str, status: str = None) -> dict:
+    """Build a lightweight per-user exam entry pointing at the shared blob (partial exams have none yet)."""
+    return {
+        "exam_name": exam_name,
+        "file_hash": file_hash,
+        "blob": None if status == "partial" else file_hash,
+        "user_email": user_email,
+        "status": status
+    }
 
 
 # --- Upload Exam Class ---
@@ -22,10 +152,6 @@ class UploadExamToDB:
         # Each user gets their own exams reference
         self.exams_ref = get_exams_ref().child(self.user_id)
 
-    def get_user_exams(self):
-        """Retrieve all exams for this user."""
-        return self.exams_ref.get() or {}
-
     def pydantic_to_dict(self, obj):
         """Convert Pydantic model or other objects to a dictionary."""
         if isinstance(obj, list):
@@ -36,57 +162,200 @@ class UploadExamToDB:
             return self.pydantic_to_dict(obj.dict())
         return obj
 
-    async def save_to_firebase(self, file_hash: str, data, exam_name: str) -> str:
+    def exam_blob(self, data) -> dict:
+        """The blob fields for extracted exam data: v2 as meta + questions, anything else as legacy v1 data."""
+        if isinstance(data, dict) and data.get("schema_version") == EXAM_SCHEMA_VERSION:
+            return {
+                "schema_version": EXAM_SCHEMA_VERSION,
+                "meta": data.get("test_data") or {},
+                "questions": data["questions"]
+            }
+        return {"data": self.pydantic_to_dict(data)}  # Convert Pydantic model to dict
+
+    async def save_to_firebase(self, file_hash: str, data, exam_name: str, exam_id: str = None,
+                               fingerprint: dict = None):
         """ 
         Save exam data to Firebase.
+        v2 exams (from Gimini_Proccess.format_exam) are stored as meta + questions;
+        anything else is stored as legacy v1 data.
         Args:
             file_hash (str): Unique identifier for the exam file.
-            data (Pydantic model): Data to be saved, should be a Pydantic model.
+            data (dict | Pydantic model): Data to be saved.
             exam_name (str): Name of the exam.
+            exam_id (str): A partial exam of this upload (save_partial_exam) to complete instead of a new entry.
+            fingerprint (dict): Text fingerprint of the file, added to the near-duplicate index.
+        Returns:
+            str | None: The exam ID, None when the partial exam `exam_id` was deleted meanwhile.
+        """
+        if exam_id:
+            exam_id = await self.complete_partial_exam(file_hash, data, exam_name, exam_id)
+            if exam_id is None:
+                return None
+        else:
+            exam_id = await self.save_new_exam(file_hash, data, exam_name)
+        if fingerprint:
+            await index_fingerprint(file_hash, fingerprint)
+        return exam_id
+
+    async def write_exam_blob(self, file_hash: str, data, exam_name: str) -> int:
+        """
+        Write a fully extracted exam to its shared blob (only complete exams are ever written there).
+        Returns:
+            int: The exam's question count.
         """
-        data_dict = self.pydantic_to_dict(data)  # Convert Pydantic model to dict
-        exam_id = self.exams_ref.push({
+        blob = self.exam_blob(data)
+        question_count = len((blob.get("data") or blob).get("questions") or [])
+        await get_exam_blobs_ref().child(file_hash).update({
             "exam_name": exam_name,
-            "file_hash": file_hash,
-            "data": data_dict,
-            "user_email": self.user_email,
-            "status": None
+            "question_count": question_count,
+            "partial": None,  # Clears the flag of blobs written by partial saves of earlier releases
+            **blob
         })
+        return question_count
+
+    async def save_new_exam(self, file_hash: str, data, exam_name: str) -> str:
+        """Store a fully extracted exam in its blob and add it to the user's exams."""
+        question_count = await self.write_exam_blob(file_hash, data, exam_name)
+        await acquire_exam_blob(file_hash, create=True)
+        exam_id = await self.exams_ref.push(exam_entry(exam_name, file_hash, self.user_email))
+        await index_exam(exam_id.key, self.user_id)
+        await add_exam_summary(self.user_id, exam_id.key, exam_name, file_hash, question_count)
+        await invalidate_user_exams(self.user_id)
         return exam_id.key  # Return the exam ID
 
-    async def check_max_exams(self) -> bool:
-        """Check if the user has reached the maximum number of exams."""
-        user_exams = self.get_user_exams()
-        return len(user_exams) < self.MAX_EXAMS
+    async def save_partial_exam(self, file_hash: str, data: dict, exam_name: str, exam_id: str = None):
+        """
+        Save the questions extracted so far so the exam can be viewed while extraction continues.
+        The first call creates the exam with status "partial"; later calls replace its questions.
+        They are kept under partial_exams/{exam_id}, apart from the shared blob, which
+        complete_partial_exam writes once the extraction finished.
+        Returns:
+            str | None: The exam ID, None when the user deleted the partial exam meanwhile.
+        """
+        if exam_id is not None and not await self.has_exam(exam_id):
+            return None
+        blob = self.exam_blob(data)
+        question_count = len((blob.get("data") or blob).get("questions") or [])
+        if exam_id is None:
+            exam_id = (await self.exams_ref.push(exam_entry(exam_name, file_hash, self.user_email, "partial"))).key
+            await index_exam(exam_id, self.user_id)
+        else:
+            await self.exams_ref.child(exam_id).update({"exam_name": exam_name})
+        await get_partial_exams_ref().child(exam_id).set({
+            "exam_name": exam_name,
+            "question_count": question_count,
+            **blob
+        })
+        await add_exam_summary(self.user_id, exam_id, exam_name, file_hash, question_count, "partial")
+        await invalidate_user_exams(self.user_id, exam_id)
+        return exam_id
+
+    async def complete_partial_exam(self, file_hash: str, data, exam_name: str, exam_id: str):
+        """
+        Store the fully extracted exam in its blob and point the partial exam at it.
+        Returns:
+            str | None: The exam ID, None when the user deleted the partial exam meanwhile.
+        """
+        if not await self.has_exam(exam_id):
+            return None
+        question_count = await self.write_exam_blob(file_hash, data, exam_name)
+        await acquire_exam_blob(file_hash, create=True)
+        await self.exams_ref.child(exam_id).update({"exam_name": exam_name, "blob": file_hash, "status": None})
+        await get_partial_exams_ref().child(exam_id).delete()
+        await add_exam_summary(self.user_id, exam_id, exam_name, file_hash, question_count)
+        await invalidate_user_exams(self.user_id, exam_id)
+        return exam_id
+
+    async def has_exam(self, exam_id: str) -> bool:
+        """Whether the user's exam entry and its index still exist (it can be deleted during extraction)."""
+        file_hash, entry = await asyncio.gather(
+            self.exams_ref.child(exam_id).child("file_hash").get(),
+            get_exam_index_ref().child(exam_id).get()
+        )
+        return file_hash is not None and entry is not None
+
+    async def get_exam_summary(self) -> dict:
+        """Retrieve the compact summary ({exam_id: {exam_name, file_hash}}) of this user's exams."""
+        return await get_exam_summaries_ref().child(self.user_id).get() or {}
+
+    async def check_max_exams(self, summary: dict = None) -> bool:
+        """
+        Check if the user has reached the maximum number of exams.
+        Args:
+            summary (dict): Summary from get_exam_summary, fetched if not given.
+        """
+        if summary is None:
+            summary = await self.get_exam_summary()
+        return len(summary) < self.MAX_EXAMS
+
+    async def same_exam_exists(self, file_hash: str, summary: dict = None) -> bool:
+        """
+        Check if an exam with the same file hash already exists for the user. If so, return True.
+        Args:
+            summary (dict): Summary from get_exam_summary, fetched if not given.
+        """
+        if summary is None:
+            summary = await self.get_exam_summary()
+        return any(exam.get("file_hash") == file_hash for exam in summary.values())
 
-    async def same_exam_exists(self, file_hash: str) -> bool:
-        """Check if an exam with the same file hash already exists for the user. If so, return True."""
-        user_exams = self.get_user_exams()
-        for exam in user_exams.values():
-            if exam.get("file_hash") == file_hash:
-                return True
-        return False
+    async def find_existing_exams(self, file_hashes: list) -> dict:
+        """
+        Look up already extracted exams for many files at once (the reads run concurrently).
+        Returns:
+            dict: {file_hash: (exam_name, question_count)} for every hash with a finished exam.
+        """
+        async def lookup(file_hash):
+            blob_ref = get_exam_blobs_ref().child(file_hash)
+            return await asyncio.gather(
+                blob_ref.child("exam_name").get(),
+                blob_ref.child("question_count").get(),
+                blob_ref.child("partial").get()
+            )
+
+        found = await asyncio.gather(*(lookup(file_hash) for file_hash in file_hashes))
+        return {
+            file_hash: (exam_name, question_count or 0)
+            for file_hash, (exam_name, question_count, partial) in zip(file_hashes, found)
+            if exam_name is not None and not partial  # Left by a partial save of an earlier release
+        }
 
-    async def exam_exists_on_other_user(self, file_hash: str) -> bool:
+    async def reuse_similar_exam(self, file_hash: str, fingerprint: dict):
         """
-        Check if an exam with the same file hash exists for another user.
-        If so, copy it to the current user.
-        Uses Firebase indexing for fast lookup.
+        Give the user the exam of a near-duplicate file (a re-saved, re-compressed or
+        watermarked copy) found in the similarity index, instead of extracting the upload.
+        Returns:
+            dict: {"examId", "examName", "duplicateOf": file hash of the reused exam}, or None.
         """
-        exams_ref = get_exams_ref()  # Global exams reference
-        # Query exams where file_hash equals the given hash
-        query_result = exams_ref.order_by_child("file_hash").equal_to(file_hash).get() or {}
+        match = await find_near_duplicate(fingerprint, exclude=file_hash)
+        if match is None:
+            return None
+        matched_hash, _ = match
+        for exam_id, exam in (await self.get_exam_summary()).items():
+            if exam.get("file_hash") == matched_hash:  # The user already has it
+                return {"examId": exam_id, "examName": exam.get("exam_name"), "duplicateOf": matched_hash}
+        linked = await self.link_existing_exam(matched_hash)
+        return {**linked, "duplicateOf": matched_hash} if linked else None
 
-        for exam_id, exam_data in query_result.items():
-            # Skip exams already uploaded by this user
-            if exam_data.get("user_id") != self.user_id:
-                # Copy exam to current user
-                new_exam = exam_data.copy()
-                new_exam['user_email'] = self.user_email
-                self.exams_ref.push(new_exam)
-                return True  # Found and copied
+    async def link_existing_exam(self, file_hash: str, existing: tuple = None):
+        """
+        Give the current user a reference to an already extracted exam.
+        Only the blob's name and question count are read, never its questions.
+        Args:
+            existing (tuple): (exam_name, question_count) from find_existing_exams, read if not given.
+        Returns:
+            dict: {"examId", "examName"} of the new entry, or None if no exam has this hash.
+        """
+        if existing is None:
+            existing = (await self.find_existing_exams([file_hash])).get(file_hash)
+        if existing is None or not await acquire_exam_blob(file_hash):
+            return None  # No matching exam found, or it is still being extracted
+        exam_name, question_count = existing
 
-        return False  # No matching exam found
+        new_ref = await self.exams_ref.push(exam_entry(exam_name, file_hash, self.user_email))
+        await index_exam(new_ref.key, self.user_id)
+        await add_exam_summary(self.user_id, new_ref.key, exam_name, file_hash, question_count or 0)
+        await invalidate_user_exams(self.user_id)
+        return {"examId": new_ref.key, "examName": exam_name}
 
 
 # --- Get Exam Class ---
@@ -97,31 +366,66 @@ class GetExamFromDB:
         # Each user gets their own exams reference
         self.exams_ref = get_exams_ref().child(self.user_id) if self.user_id else None
 
-    def get_exams(self):
+    async def get_exam_summaries(self):
         """
-        Retrieve exams from Firebase for the user.
+        Retrieve the lightweight exam summaries (name, status, question count) for the user (cached).
         Raises:
             ValueError: If user_id is missing.
         """
         if not self.user_id:
             raise ValueError("User ID is required to get exams for a user.")
-        return self.exams_ref.get() or {}
+        summaries = exam_summaries_cache.get(self.user_id)
+        if summaries is None:
+            summaries = await get_exam_summaries_ref().child(self.user_id).get() or {}
+            exam_summaries_cache.set(self.user_id, summaries)
+        return summaries
 
-    def get_exam_details_by_exam_id(self, exam_id: str):
+    async def get_exam_details_by_exam_id(self, exam_id: str):
         """
-        Search all users' exams for a given exam_id.
+        Find an exam of any user by exam_id using the exam index (cached).
         Args:
             exam_id (str): ID of the exam to find.
         Returns:
             dict: Exam data if found, else empty dict.
         """
-        all_exams = get_exams_ref().get() or {}
-        for user_id, exams in all_exams.items():
-            if exams and exam_id in exams:
-                return exams[exam_id]
-        return {}
+        exam = exam_details_cache.get(exam_id)
+        if exam is not None:
+            return exam
+        try:
+            index_ref = get_exam_index_ref().child(exam_id)
+        except ValueError:  # exam_id is not a valid Firebase key
+            return {}
+        entry = await index_ref.get()
+        if not entry:
+            return {}
+        exam = await reference(entry["path"]).get() or {}
+        if exam.get("status") == "partial":
+            exam["data"] = exam_data_from_blob(await get_partial_exams_ref().child(exam_id).get() or {})
+        elif exam.get("blob") and "data" not in exam:
+            blob = await get_exam_blobs_ref().child(exam["blob"]).get() or {}
+            exam["data"] = exam_data_from_blob(blob)
+        if exam and exam.get("status") != "partial":  # Partial exams change until extraction finishes
+            exam_details_cache.set(exam_id, exam)
+        return exam
+
+    async def get_exam_questions(self, exam_id: str, offset: int = 0, limit: int = None):
+        """
+        Return one page of an exam's questions, read from the cached exam details.
+        Args:
+            exam_id (str): ID of the exam.
+            offset (int): Index of the first question to return.
+            limit (int): Maximum number of questions, or None for the rest of the exam.
+        Returns:
+            tuple: (questions, total question count), or None if the exam does not exist.
+        """
+        exam = await self.get_exam_details_by_exam_id(exam_id)
+        if not exam:
+            return None
+        questions = (exam.get("data") or {}).get("questions") or []
+        end = None if limit is None else offset + limit
+        return questions[offset:end], len(questions)
 
-    def delete_exam(self, exam_id: str) -> bool:
+    async def delete_exam(self, exam_id: str) -> bool:
         """
         Delete an exam by exam_id for the user.
         Args:
@@ -132,7 +436,19 @@ class GetExamFromDB:
         if not self.user_id:
             raise ValueError("User ID is required to delete an exam.")
         try:
-            self.exams_ref.child(exam_id).delete()
+            exam_ref = self.exams_ref.child(exam_id)
+            blob = await exam_ref.child("blob").get()
+            await exam_ref.delete()
+            await get_exam_summaries_ref().child(self.user_id).child(exam_id).delete()
+            if blob:
+                await release_exam_blob(blob)
+            else:
+                await get_partial_exams_ref().child(exam_id).delete()
+            index_ref = get_exam_index_ref().child(exam_id)
+            entry = await index_ref.get()
+            if entry and entry.get("user_id") == self.user_id:
+                await index_ref.delete()
+            await invalidate_user_exams(self.user_id, exam_id)
             return True
         except Exception as e:
             raise ValueError(f"An error occurred while deleting the exam: {str(e)}")
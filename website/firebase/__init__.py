@@ -1,14 +1,35 @@
-import firebase_admin
-from firebase_admin import credentials, db
 import os
+import threading
 
 FIREBASE_DB_URL = os.environ.get("FIREBASE_DATABASE_URL")
 FIREBASE_JSON = os.environ.get("FIREBASE_JSON")
 
+_init_lock = threading.Lock()
+
+
 def init_firebase():
+    import firebase_admin  # Deferred with the app itself: firebase_admin pulls in most of google-auth
+    from firebase_admin import credentials, db as firebase_db
     if not firebase_admin._apps:  # Prevent re-init
-        cred = credentials.Certificate(FIREBASE_JSON)
-        firebase_admin.initialize_app(cred, {"databaseURL": FIREBASE_DB_URL})
-    return db
+        with _init_lock:  # First references may come from several storage threads at once
+            if not firebase_admin._apps:
+                cred = credentials.Certificate(FIREBASE_JSON)
+                firebase_admin.initialize_app(cred, {"databaseURL": FIREBASE_DB_URL})
+    return firebase_db
+
+
+class LazyDatabase:
+    """
+    Stands in for firebase_admin.db: the app is initialized on the first
+    reference() (or at startup/readiness warm-up) instead of at import, so
+    importing the app never reads credentials.
+    """
+
+    def reference(self, path="/"):
+        return init_firebase().reference(path)
+
+    def __getattr__(self, name):
+        return getattr(init_firebase(), name)
+
 
-db = init_firebase()
\ No newline at end of file
+db = LazyDatabase()
@@ -0,0 +1,59 @@
+"""
+Stored exam formats.
+
+v1 (legacy): data = {"test_data": {...}, "questions": [{"question_number", "question_data",
+    "answers": [{"answer": str}], "correct_answer": {"answer": str}}]}
+v2: the blob keeps "meta" (test_data) and "questions" side by side, each question being
+    {"question_number", "question_data", "answers": [str], "correct_index": int}
+"""
+
+EXAM_SCHEMA_VERSION = 2
+
+
+def question_v1_to_v2(question: dict) -> dict:
+    """Convert a v1 question to v2. The correct answer falls back to the first one if it is missing."""
+    answers = [answer.get("answer", "") if isinstance(answer, dict) else answer
+               for answer in question.get("answers") or []]
+    correct = (question.get("correct_answer") or {}).get("answer")
+    return {
+        "question_number": question.get("question_number"),
+        "question_data": question.get("question_data", ""),
+        "answers": answers,
+        "correct_index": answers.index(correct) if correct in answers else 0
+    }
+
+
+def blob_v1_to_v2(data: dict) -> dict:
+    """Return the v2 fields (schema_version, meta, questions) for v1 exam data."""
+    return {
+        "schema_version": EXAM_SCHEMA_VERSION,
+        "meta": data.get("test_data") or {},
+        "questions": [question_v1_to_v2(q) for q in data.get("questions") or []]
+    }
+
+
+def exam_data_from_blob(blob: dict) -> dict:
+    """
+    Return the `data` readers (GetExamFromDB, exam.html) expect from a stored blob of any version.
+    v1 data is returned unchanged; v2 is returned as {"schema_version", "test_data", "questions"}.
+    """
+    if "data" in blob:
+        return blob["data"] or {}
+    return {
+        "schema_version": blob.get("schema_version", EXAM_SCHEMA_VERSION),
+        "test_data": blob.get("meta") or {},
+        "questions": blob.get("questions") or []
+    }
+
+
+def content_version(exam: dict) -> str:
+    """
+    Return a version string for an exam's stored content: the blob it points to and its schema.
+    Blobs are immutable per file_hash once extracted, so the version only changes when the content
+    does; a partial exam (still being extracted) also changes with its question count.
+    """
+    data = exam.get("data") or {}
+    version = f'{exam.get("blob") or exam.get("file_hash")}.v{data.get("schema_version", 1)}'
+    if exam.get("status") == "partial":
+        version += f'.p{len(data.get("questions") or [])}'
+    return version
@@ -0,0 +1,131 @@
+"""
+Maintenance commands for existing Firebase data.
+
+Usage:
+    python -m website.firebase.migrations backfill-exam-index
+    python -m website.firebase.migrations dedupe-exam-blobs
+    python -m website.firebase.migrations backfill-exam-summaries
+    python -m website.firebase.migrations migrate-exam-blobs-v2
+"""
+import argparse
+import asyncio
+
+from .Exam import (
+    get_exams_ref, index_exam, get_exam_blobs_ref, acquire_exam_blob, exam_entry,
+    get_exam_summaries_ref, add_exam_summary
+)
+from .exam_format import blob_v1_to_v2
+
+
+async def backfill_exam_index() -> int:
+    """
+    Write an exam_index entry for every stored exam.
+    Reads keys only (shallow), so no exam payloads are downloaded.
+    Returns:
+        int: Number of exams indexed.
+    """
+    exams_ref = get_exams_ref()
+    user_ids = await exams_ref.get(shallow=True) or {}
+    indexed = 0
+    for user_id in user_ids:
+        exam_ids = await exams_ref.child(user_id).get(shallow=True) or {}
+        for exam_id in exam_ids:
+            await index_exam(exam_id, user_id)
+            indexed += 1
+    return indexed
+
+
+async def dedupe_exam_blobs() -> int:
+    """
+    Move inline exam payloads into the shared exam_blobs store.
+    Each per-user copy is replaced with a reference to the blob of its file_hash.
+    Returns:
+        int: Number of exam entries converted.
+    """
+    exams_ref = get_exams_ref()
+    blobs_ref = get_exam_blobs_ref()
+    user_ids = await exams_ref.get(shallow=True) or {}
+    converted = 0
+    for user_id in user_ids:
+        exam_ids = await exams_ref.child(user_id).get(shallow=True) or {}
+        for exam_id in exam_ids:
+            exam_ref = exams_ref.child(user_id).child(exam_id)
+            exam = await exam_ref.get() or {}
+            file_hash = exam.get("file_hash")
+            if "data" not in exam or not file_hash:
+                continue  # Already a reference, or nothing to key the blob on
+            if await blobs_ref.child(file_hash).child("exam_name").get() is None:
+                await blobs_ref.child(file_hash).update({
+                    "exam_name": exam.get("exam_name"),
+                    "data": exam["data"]
+                })
+            await acquire_exam_blob(file_hash, create=True)
+            await exam_ref.set(exam_entry(exam.get("exam_name"), file_hash, exam.get("user_email")))
+            converted += 1
+    return converted
+
+
+async def backfill_exam_summaries() -> int:
+    """
+    Rebuild exam_summaries/{user_id} from the per-user exam entries.
+    Run after dedupe-exam-blobs so the entries no longer carry question data.
+    Question counts are taken with shallow reads and stored on the blob as well.
+    Returns:
+        int: Number of users summarized.
+    """
+    exams_ref = get_exams_ref()
+    blobs_ref = get_exam_blobs_ref()
+    question_counts = {}  # file_hash -> count
+    user_ids = await exams_ref.get(shallow=True) or {}
+    for user_id in user_ids:
+        exams = await exams_ref.child(user_id).get() or {}
+        await get_exam_summaries_ref().child(user_id).delete()
+        for exam_id, exam in exams.items():
+            file_hash = exam.get("file_hash")
+            if file_hash and file_hash not in question_counts:
+                questions = (await blobs_ref.child(file_hash).child("questions").get(shallow=True)
+                             or await blobs_ref.child(file_hash).child("data/questions").get(shallow=True) or {})
+                question_counts[file_hash] = len(questions)
+                await blobs_ref.child(file_hash).child("question_count").set(len(questions))
+            await add_exam_summary(user_id, exam_id, exam.get("exam_name"), file_hash,
+                                   question_counts.get(file_hash, 0))
+    return len(user_ids)
+
+
+async def migrate_exam_blobs_v2() -> int:
+    """
+    Convert v1 exam blobs (answer objects, duplicated correct_answer) to the compact v2 format.
+    Run after dedupe-exam-blobs. Blobs are read one at a time.
+    Returns:
+        int: Number of blobs converted.
+    """
+    blobs_ref = get_exam_blobs_ref()
+    file_hashes = await blobs_ref.get(shallow=True) or {}
+    converted = 0
+    for file_hash in file_hashes:
+        data = await blobs_ref.child(file_hash).child("data").get()
+        if data is None:
+            continue  # Already v2
+        await blobs_ref.child(file_hash).update({**blob_v1_to_v2(data), "data": None})
+        converted += 1
+    return converted
+
+
+COMMANDS = {
+    "backfill-exam-index": backfill_exam_index,
+    "dedupe-exam-blobs": dedupe_exam_blobs,
+    "backfill-exam-summaries": backfill_exam_summaries,
+    "migrate-exam-blobs-v2": migrate_exam_blobs_v2,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Firebase data migrations")
+    parser.add_argument("command", choices=COMMANDS.keys())
+    args = parser.parse_args()
+    result = asyncio.run(COMMANDS[args.command]())
+    print(f"{args.command}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Similarity index of extracted exams, keyed by the file hash of their shared blob.
+
+    exam_fingerprints/{file_hash}: {"pages", "signature"}  (gimini/fingerprint.py)
+    exam_lsh/{band}-{bucket}/{file_hash}: true
+
+Finished exams are added when they are saved and removed with their blob, so
+the index follows exam_blobs. A lookup reads the LSH bucket of each band
+concurrently and compares the fingerprints of the candidates found there.
+"""
+from typing import Optional, Tuple
+import asyncio
+import logging
+import os
+
+from .storage import reference
+from ..gimini.fingerprint import band_keys, similarity
+from ..utils import metrics
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.85"))  # Estimated Jaccard similarity to reuse an exam
+
+NEAR_DUPLICATE_LOOKUPS = metrics.counter("near_duplicate_lookups_total", "Similarity index lookups by result",
+                                         ["result"])  # match | candidates | miss
+
+
+def get_fingerprints_ref():
+    """Return the file_hash -> fingerprint reference."""
+    return reference("exam_fingerprints")
+
+
+def get_lsh_ref():
+    """Return the LSH bucket -> file hashes reference."""
+    return reference("exam_lsh")
+
+
+async def index_fingerprint(file_hash: str, fingerprint: dict):
+    """Add an extracted exam to the similarity index."""
+    await get_fingerprints_ref().child(file_hash).set(fingerprint)
+    await asyncio.gather(*(get_lsh_ref().child(key).child(file_hash).set(True) for key in band_keys(fingerprint)))
+
+
+async def remove_fingerprint(file_hash: str):
+    """Remove an exam from the similarity index (when its blob is deleted)."""
+    fingerprint_ref = get_fingerprints_ref().child(file_hash)
+    fingerprint = await fingerprint_ref.get()
+    if not fingerprint:
+        return
+    await asyncio.gather(*(get_lsh_ref().child(key).child(file_hash).delete() for key in band_keys(fingerprint)))
+    await fingerprint_ref.delete()
+
+
+async def find_near_duplicate(fingerprint: dict, exclude: str = None,
+                              threshold: float = NEAR_DUPLICATE_THRESHOLD) -> Optional[Tuple[str, float]]:
+    """
+    Find the indexed exam most similar to a fingerprint.
+    Args:
+        exclude (str): file hash to ignore (the upload's own).
+    Returns:
+        tuple: (file_hash, similarity) of the best match at or above `threshold`, or None.
+    """
+    buckets = await asyncio.gather(*(get_lsh_ref().child(key).get(shallow=True) for key in band_keys(fingerprint)))
+    candidates = set().union(*(bucket or {} for bucket in buckets)) - {exclude}
+    if not candidates:
+        NEAR_DUPLICATE_LOOKUPS.inc(result="miss")
+        return None
+    candidates = list(candidates)
+    stored = await asyncio.gather(*(get_fingerprints_ref().child(file_hash).get() for file_hash in candidates))
+    scored = [(similarity(fingerprint, other), file_hash) for file_hash, other in zip(candidates, stored) if other]
+    best, file_hash = max(scored, default=(0.0, None))
+    if file_hash is None or best < threshold:
+        NEAR_DUPLICATE_LOOKUPS.inc(result="candidates")
+        return None
+    NEAR_DUPLICATE_LOOKUPS.inc(result="match")
+    logger.info("Upload is a near-duplicate (%.2f) of exam blob %s", best, file_hash)
+    return file_hash, best
@@ -0,0 +1,102 @@
+"""
+Async facade over the Realtime Database.
+
+firebase_admin is synchronous, so every call is run on a bounded, dedicated
+thread pool instead of blocking the event loop. Calls are counted and timed,
+with the approximate JSON size of what was written and read.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import json
+import os
+import time
+
+from . import db
+from ..utils import metrics
+
+FIREBASE_IO_WORKERS = int(os.environ.get("FIREBASE_IO_WORKERS", "16"))  # Max concurrent Firebase calls
+
+_executor = ThreadPoolExecutor(max_workers=FIREBASE_IO_WORKERS, thread_name_prefix="firebase-io")
+
+FIREBASE_CALLS = metrics.counter("firebase_calls_total", "Realtime Database calls", ["op", "outcome"])
+FIREBASE_SECONDS = metrics.histogram("firebase_call_seconds", "Realtime Database call latency", ["op"])
+FIREBASE_BYTES = metrics.counter("firebase_bytes_total", "Approximate JSON bytes written to and read from the Realtime Database",
+                                 ["direction"])
+
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking Firebase call on the storage thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def _json_size(value) -> int:
+    if value is None:
+        return 0
+    try:
+        return len(json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str).encode())
+    except (TypeError, ValueError):
+        return 0
+
+
+def _measured(op: str, func, sent=None, read: bool = False):
+    """Wrap a blocking call to record its latency, outcome and payload sizes (measured on the pool thread)."""
+    def call(*args, **kwargs):
+        if sent is not None:
+            FIREBASE_BYTES.inc(_json_size(sent), direction="write")
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = func(*args, **kwargs)
+            outcome = "ok"
+        finally:
+            FIREBASE_SECONDS.observe(time.perf_counter() - started, op=op)
+            FIREBASE_CALLS.inc(op=op, outcome=outcome)
+        if read:
+            FIREBASE_BYTES.inc(_json_size(result), direction="read")
+        return result
+    return call
+
+
+class AsyncReference:
+    """Awaitable counterpart of firebase_admin.db.Reference."""
+
+    def __init__(self, path: str):
+        self.path = path.strip("/")
+        self._ref = db.reference(self.path)  # No I/O, only validates the path
+
+    @property
+    def key(self):
+        return self._ref.key
+
+    def child(self, path: str) -> "AsyncReference":
+        return AsyncReference(f"{self.path}/{path}")
+
+    async def get(self, shallow: bool = False):
+        return await run_io(_measured("get", self._ref.get, read=True), shallow=shallow)
+
+    async def set(self, value):
+        await run_io(_measured("set", self._ref.set, sent=value), value)
+
+    async def update(self, value: dict):
+        await run_io(_measured("update", self._ref.update, sent=value), value)
+
+    async def push(self, value) -> "AsyncReference":
+        new_ref = await run_io(_measured("push", self._ref.push, sent=value), value)
+        return self.child(new_ref.key)
+
+    async def delete(self):
+        await run_io(_measured("delete", self._ref.delete))
+
+    async def transaction(self, transaction_update):
+        return await run_io(_measured("transaction", self._ref.transaction, read=True), transaction_update)
+
+    async def equal_to(self, child: str, value):
+        """Return children whose `child` field equals `value` (requires an .indexOn rule)."""
+        return await run_io(_measured("query", lambda: self._ref.order_by_child(child).equal_to(value).get(), read=True))
+
+
+def reference(path: str) -> AsyncReference:
+    """Return an AsyncReference for a database path."""
+    return AsyncReference(path)
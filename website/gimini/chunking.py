@@ -0,0 +1,92 @@
+from typing import List
+import re
+
+from .instructions import Main, TestMeta
+
+
+def page_ranges(page_count: int, chunk_pages: int, overlap: int) -> List[range]:
+    """
+    Split pages into ranges of chunk_pages, each starting `overlap` pages before the
+    previous one ends so questions crossing a boundary are fully inside one chunk.
+    """
+    step = max(chunk_pages - overlap, 1)
+    ranges = []
+    start = 0
+    while start < page_count:
+        end = min(start + chunk_pages, page_count)
+        ranges.append(range(start, end))
+        if end == page_count:
+            break
+        start += step
+    return ranges
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", text or "")).strip().lower()
+
+
+def _answer_set(question) -> set:
+    return {_normalize(answer.answer) for answer in question.answers}
+
+
+def _same_question(earlier, later, truncated: bool = False) -> bool:
+    """
+    Whether two questions are the same question read twice from an overlap page: the stems match
+    exactly or one is a cut-off prefix of the other, and the answer sets are equal.
+    Args:
+        truncated: `earlier` ends its chunk and may miss answers on the next page.
+    """
+    text_a, text_b = _normalize(earlier.question_data), _normalize(later.question_data)
+    if not text_a or not text_b or not (text_a.startswith(text_b) or text_b.startswith(text_a)):
+        return False
+    answers_a, answers_b = _answer_set(earlier), _answer_set(later)
+    return answers_a == answers_b or (truncated and answers_a <= answers_b)
+
+
+def _overlap_length(previous_chunk: list, current_chunk: list) -> int:
+    """
+    How many questions at the head of a chunk repeat the tail of the previous one (the overlap pages):
+    the longest run where the previous chunk's last k questions match the current chunk's first k in order.
+    """
+    for length in range(min(len(previous_chunk), len(current_chunk)), 0, -1):
+        tail, head = previous_chunk[-length:], current_chunk[:length]
+        if all(_same_question(earlier, later, truncated=index == length - 1)
+               for index, (earlier, later) in enumerate(zip(tail, head))):
+            return length
+    return 0
+
+
+def merge_results(results: List[Main]) -> Main:
+    """
+    Merge per-chunk extraction results (in page order) into a single exam.
+    Only the questions of the overlap pages are deduplicated (the tail of the previous chunk
+    against the head of the next one) and the most complete copy is kept; questions are
+    renumbered sequentially in document order.
+    """
+    questions = []
+    test_data = None
+    previous_chunk = []
+    for result in results:
+        if result is None or result.status == "error":
+            previous_chunk = []
+            continue
+        if test_data is None and result.test_data and result.test_data.test_description:
+            test_data = result.test_data
+
+        current_chunk = sorted(result.questions, key=lambda q: q.question_number)
+        overlap = _overlap_length(previous_chunk, current_chunk)
+        for index in range(overlap):
+            duplicate, question = previous_chunk[len(previous_chunk) - overlap + index], current_chunk[index]
+            if len(question.answers) > len(duplicate.answers) or \
+                    len(question.question_data) > len(duplicate.question_data):
+                questions[next(i for i, q in enumerate(questions) if q is duplicate)] = question
+            else:
+                current_chunk[index] = duplicate  # Keep the copy already merged
+        questions.extend(current_chunk[overlap:])
+        previous_chunk = current_chunk
+
+    for number, question in enumerate(questions, start=1):
+        question.question_number = number
+
+    test_data = test_data or TestMeta(test_description="", test_time="")
+    return Main(questions=questions, test_data=test_data, status="ok" if questions else "error")
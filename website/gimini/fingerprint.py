@@ -0,0 +1,92 @@
+"""
+Text fingerprints for spotting near-duplicate exam PDFs.
+
+Re-exported, re-compressed or watermarked copies of a paper have a different
+SHA-256 but almost the same text layer. A fingerprint is a MinHash signature of
+the word 3-grams of all pages' text plus the page count: the share of equal
+signature slots of two fingerprints estimates the Jaccard similarity of their
+texts. Signatures are split into LSH bands so an index only has to compare a
+fingerprint with exams that share at least one band.
+
+PDFs with too little text (image-only scans) get no fingerprint and are only
+deduplicated by their hash.
+"""
+from typing import List, Optional
+import hashlib
+import os
+import re
+import unicodedata
+
+NEAR_DUPLICATE_DETECTION = os.environ.get("NEAR_DUPLICATE_DETECTION", "1") == "1"  # Fingerprint uploads and reuse near-duplicate exams
+FINGERPRINT_MIN_CHARS = int(os.environ.get("FINGERPRINT_MIN_CHARS", "500"))  # Less text gives no fingerprint
+SHINGLE_WORDS = 3
+SIGNATURE_SIZE = 64  # MinHash values per signature
+LSH_BANDS = 16  # Bands of SIGNATURE_SIZE // LSH_BANDS values; texts with Jaccard 0.8 share a band with probability > 0.999
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1  # Values are stored in 32 bits (8 hex digits)
+WORD = re.compile(r"\w+")
+
+
+def _coefficient(name: str) -> int:
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "big") % (_PRIME - 1) + 1
+
+
+# Fixed permutations h(x) = (a * x + b) mod p, the same in every process and release
+_PERMUTATIONS = [(_coefficient(f"a{i}"), _coefficient(f"b{i}")) for i in range(SIGNATURE_SIZE)]
+
+
+def normalize_words(text: str) -> List[str]:
+    """Lower-cased words of the text, with ligatures and full-width forms folded (NFKC)."""
+    return WORD.findall(unicodedata.normalize("NFKC", text).lower())
+
+
+def shingles(words: List[str]) -> set:
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(items: set) -> str:
+    """MinHash signature of a set of strings, as SIGNATURE_SIZE 32-bit values in hex."""
+    hashes = [int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big") % _PRIME
+              for item in items]
+    return "".join(f"{min((a * x + b) % _PRIME for x in hashes) & _MASK:08x}" for a, b in _PERMUTATIONS)
+
+
+def fingerprint(page_texts: List[str]) -> Optional[dict]:
+    """
+    Fingerprint a PDF from the text of each of its pages.
+    Returns:
+        dict: {"pages", "signature"}, or None when the PDF has too little text.
+    """
+    text = "\n".join(page_texts)
+    words = normalize_words(text)
+    if sum(len(word) for word in words) < FINGERPRINT_MIN_CHARS:
+        return None
+    return {"pages": len(page_texts), "signature": minhash(shingles(words))}
+
+
+def _values(signature: str) -> List[str]:
+    return [signature[i:i + 8] for i in range(0, len(signature), 8)]
+
+
+def similarity(first: dict, second: dict) -> float:
+    """Estimated Jaccard similarity of two fingerprints' texts (0 for different page counts)."""
+    if first.get("pages") != second.get("pages"):
+        return 0.0
+    a, b = _values(first["signature"]), _values(second["signature"])
+    if len(a) != len(b):
+        return 0.0  # Made with another SIGNATURE_SIZE
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def band_keys(fingerprint: dict) -> List[str]:
+    """LSH bucket of each band, as "{band}-{hash}"; the page count is part of every bucket."""
+    values = _values(fingerprint["signature"])
+    rows = len(values) // LSH_BANDS
+    keys = []
+    for band in range(LSH_BANDS):
+        chunk = f"{fingerprint['pages']}:" + "".join(values[band * rows:(band + 1) * rows])
+        keys.append(f"{band}-{hashlib.sha1(chunk.encode()).hexdigest()[:16]}")
+    return keys
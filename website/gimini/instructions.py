@@ -50,6 +50,6 @@ class Main(BaseModel):
     - 'questions' should contain all closed questions with their cleaned answers.
     - 'test_data' should include the exam subject/description, date, and time.
     """
+    test_data: TestMeta = Field(description="Exam metadata: subject and date/time.")  # First, so a streamed response names the exam early
     questions: List[Questions] = Field(description="A list of all closed questions in the exam.")
-    test_data: TestMeta = Field(description="Exam metadata: subject and date/time.")
     status:str = Field(description="Status of the exam processing. If the PDF is unrelated or does not contain closed questions exam, return 'error'.")
@@ -0,0 +1,136 @@
+"""
+Gemini cached content for the fixed extraction instructions.
+
+The extraction prompt is identical for every exam, so it is uploaded once as
+cached content (as the system instruction) and each call only sends the PDF.
+The cache is named after a hash of the model, the prompt and the response
+schema, so changing any of them starts a new cache, and workers that share an
+API key reuse the same one instead of creating their own.
+
+The prompt's size is checked with count_tokens first: a prompt below the model's
+minimum for explicit caching (GEMINI_CONTEXT_CACHE_MIN_TOKENS) can never be
+cached, so the cache is switched off for the life of the process instead of
+retrying a failing create on the extraction path. The current extraction prompt
+(about 500 tokens) is below Gemini 2.5 Flash's minimum of 1024.
+
+When caching is disabled, fails or the cache disappears, callers get None and
+send the prompt inline; creation is retried after GEMINI_CONTEXT_CACHE_RETRY seconds.
+"""
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from ..utils import metrics
+
+logger = logging.getLogger(__name__)
+
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "1") == "1"  # Cache the extraction prompt on Gemini
+GEMINI_CONTEXT_CACHE_TTL = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", "3600"))  # Seconds a created cache lives
+GEMINI_CONTEXT_CACHE_RETRY = float(os.environ.get("GEMINI_CONTEXT_CACHE_RETRY", "600"))  # Seconds before retrying a failed creation
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))  # Smallest cached content the model accepts
+REFRESH_MARGIN = 60  # Replace a cache this many seconds before it expires, so no call races its expiry
+
+CONTEXT_CACHE_LOOKUPS = metrics.counter("gemini_context_cache_total", "Prompt cache lookups by result",
+                                        ["result"])  # hit | reused | created | unavailable | too_small
+
+
+def prompt_version(model: str, prompt: str, schema) -> str:
+    """Hash of everything the cached content depends on."""
+    schema_json = json.dumps(schema.model_json_schema(), sort_keys=True)
+    return hashlib.sha256("\x1f".join((model, prompt, schema_json)).encode()).hexdigest()[:16]
+
+
+class PromptCache:
+    """Holds the name of the cached content for one (model, prompt, schema) and refreshes it before expiry."""
+
+    def __init__(self, model: str, prompt: str, schema, ttl: int = GEMINI_CONTEXT_CACHE_TTL,
+                 retry: float = GEMINI_CONTEXT_CACHE_RETRY, enabled: bool = GEMINI_CONTEXT_CACHE,
+                 min_tokens: int = GEMINI_CONTEXT_CACHE_MIN_TOKENS):
+        self.model = model
+        self.prompt = prompt
+        self.version = prompt_version(model, prompt, schema)
+        self.display_name = f"exam-extraction-{self.version}"
+        self.ttl = ttl
+        self.retry = retry
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.prompt_tokens = None  # Counted once, on first use
+        self.name = None
+        self.expires_at = 0.0  # time.time() at which the cache expires
+        self.failed_at = None
+        self.lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self.name is not None and time.time() < self.expires_at - REFRESH_MARGIN
+
+    async def get(self, client):
+        """
+        Return the name of a live cached content holding the prompt, creating it if needed.
+        Returns:
+            str | None: None when the prompt has to be sent inline.
+        """
+        if not self.enabled:
+            return None
+        if self._fresh():
+            CONTEXT_CACHE_LOOKUPS.inc(result="hit")
+            return self.name
+        if self.failed_at is not None and time.monotonic() - self.failed_at < self.retry:
+            CONTEXT_CACHE_LOOKUPS.inc(result="unavailable")
+            return None
+
+        async with self.lock:
+            if self._fresh():  # Refreshed by another call while we waited
+                CONTEXT_CACHE_LOOKUPS.inc(result="hit")
+                return self.name
+            try:
+                if self.prompt_tokens is None:
+                    counted = await client.aio.models.count_tokens(model=self.model, contents=self.prompt)
+                    self.prompt_tokens = counted.total_tokens or 0
+                if self.prompt_tokens < self.min_tokens:
+                    logger.info("Extraction prompt has %d tokens, below the %d Gemini can cache; sending it inline",
+                                self.prompt_tokens, self.min_tokens)
+                    self.enabled = False
+                    CONTEXT_CACHE_LOOKUPS.inc(result="too_small")
+                    return None
+                cached = await self._find(client)
+                result = "reused"
+                if cached is None:
+                    cached = await client.aio.caches.create(model=self.model, config={
+                        "display_name": self.display_name,
+                        "system_instruction": self.prompt,
+                        "ttl": f"{self.ttl}s",
+                    })
+                    result = "created"
+            except Exception as e:
+                logger.warning("Gemini prompt cache unavailable, sending the prompt inline: %s", e)
+                self.name = None
+                self.failed_at = time.monotonic()
+                CONTEXT_CACHE_LOOKUPS.inc(result="unavailable")
+                return None
+            self.name = cached.name
+            self.expires_at = self._expiry(cached)
+            self.failed_at = None
+            CONTEXT_CACHE_LOOKUPS.inc(result=result)
+            logger.info("Using Gemini prompt cache %s (%s) until %s", cached.name, result,
+                        datetime.fromtimestamp(self.expires_at, timezone.utc).isoformat())
+            return self.name
+
+    async def _find(self, client):
+        """A live cache of this prompt version created by another worker, if there is one."""
+        async for cached in await client.aio.caches.list():
+            if cached.display_name == self.display_name and self._expiry(cached) - REFRESH_MARGIN > time.time():
+                return cached
+        return None
+
+    def _expiry(self, cached) -> float:
+        expire_time = getattr(cached, "expire_time", None)
+        return expire_time.timestamp() if expire_time else time.time() + self.ttl
+
+    def invalidate(self, name: str):
+        """Forget a cache the API no longer accepts; the next call creates a new one."""
+        if self.name == name:
+            self.name = None
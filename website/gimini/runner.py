@@ -1,111 +1,371 @@
-from google import genai
-from google.genai import types
-from .instructions import Main
-import random
-import copy
+from .instructions import Main, Questions, TestMeta
+from ..firebase.exam_format import EXAM_SCHEMA_VERSION
+from .chunking import merge_results
+from .prompt_cache import PromptCache
+from .stream_parser import QuestionStreamParser
+from .text_layer import prepare
+from ..utils import metrics
+import asyncio
+import logging
 import os
-client = genai.Client(api_key=os.environ.get('GIMINI_API_KEY'))
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+GIMINI_API_KEY = os.environ.get('GIMINI_API_KEY')
+GEMINI_MODEL = "models/gemini-2.5-flash"
+
+GEMINI_CHUNK_PAGES = int(os.environ.get("GEMINI_CHUNK_PAGES", "8"))  # Pages per chunk, 0 disables chunking
+GEMINI_CHUNK_OVERLAP = int(os.environ.get("GEMINI_CHUNK_OVERLAP", "1"))  # Pages shared by neighbouring chunks
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "4"))  # Concurrent Gemini calls per process
+GEMINI_STREAM = os.environ.get("GEMINI_STREAM", "1") == "1"  # Stream responses and report questions as they arrive
+
+gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+GEMINI_CALLS = metrics.counter("gemini_calls_total", "Gemini generate_content calls", ["outcome"])
+GEMINI_SECONDS = metrics.histogram("gemini_call_seconds", "Gemini generate_content latency (excluding the wait for a slot)")
+GEMINI_TOKENS = metrics.counter("gemini_tokens_total", "Gemini tokens reported in usage_metadata", ["kind"])
+PDF_PAGES = metrics.counter("pdf_pages_total", "Uploaded PDF pages by how they are sent to Gemini", ["kind"])
+GEMINI_USAGE_FIELDS = {  # usage_metadata attribute -> kind label
+    "prompt_token_count": "prompt",
+    "cached_content_token_count": "cached",
+    "candidates_token_count": "output",
+    "thoughts_token_count": "thoughts",
+    "total_token_count": "total",
+}
+
+
+def record_usage(response) -> dict:
+    """
+    Add a response's token usage to the Gemini counters.
+    Returns:
+        dict: tokens per kind, with "uncached" = prompt tokens not served from a cache.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return {}
+    tokens = {kind: getattr(usage, field, None) or 0 for field, kind in GEMINI_USAGE_FIELDS.items()}
+    tokens["uncached"] = max(tokens["prompt"] - tokens["cached"], 0)
+    for kind, count in tokens.items():
+        GEMINI_TOKENS.inc(count, kind=kind)
+    return tokens
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the Gemini client, created on first use. google.genai is the slowest
+    import of the app, so it is only loaded when a client is actually needed.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                _client = genai.Client(api_key=GIMINI_API_KEY)
+    return _client
+
+EXTRACTION_PROMPT = (
+    """Extract all closed questions with answer options from the provided exam PDF.
+    If the PDF is unrelated or does not contain exam questions, return {'status':'error'}. as JSON.
+
+    Rules:
+    - Copy the full question text, including any data, graphs, or tables.
+    - Remove all enumeration or label symbols like "a. ", "b. ", "א. ", etc. from the answers.
+    - Format code snippets or blocks with <pre dir="ltr" style="text-align:left"><code>put the code here</code></pre> tags, preserving tabs and whitespace. Add <br> tags to maintain line breaks.
+    - If the PDF is unrelated or does not contain exam questions, return {"test_data": "error"} as JSON.
+    - The output must be valid JSON exactly matching this schema:
+    - test_data: {
+        test_description: string (e.g., "Physics Exam | 21/06/2025") Do not change the language of the exam name, keep it as is.
+        test_time: string in Hours and minutes (e.g., "3:30 Hours")
+        }
+    - questions: list of objects with:
+        - question_number: integer
+        - question_data: string (full question text, excluding answers)
+        - answers: list of objects each with:
+            - answer: string (clean answer text without enumeration)
+
+    Example Input:
+    Question 1: What is the speed of light?
+    a. 3 x 10^8 m/s
+    b. 1.5 x 10^8 m/s
+    c. 9.8 m/s^2
+
+    Example Output:
+    {
+    "test_data": {
+        "test_description": "Physics Exam | 21/06/2025",
+        "test_time": "3 Hours"
+    },
+    "questions": [
+        {
+        "question_number": 1,
+        "question_data": "What is the speed of light?",
+        "answers": [
+            {"answer": "3 x 10^8 m/s"},
+            {"answer": "1.5 x 10^8 m/s"},
+            {"answer": "9.8 m/s^2"}
+        ]
+        }
+    ]
+    }
+
+    Now extract from the following PDF:"""
+)
+
+prompt_cache = PromptCache(GEMINI_MODEL, EXTRACTION_PROMPT, Main)
+
+CHUNK_PROMPT = (
+    """These are pages {first}-{last} of a longer exam.
+    - Skip a question at the start of these pages if its beginning is missing.
+    - Skip a question at the end of these pages if its answer options are cut off.
+    Both appear in full in the neighbouring pages.
+    """
+)
+
+TEXT_LAYER_PROMPT = (
+    """The exam is given in page order: pages with a text layer as text under "--- Page N ---" headers,
+    the other pages as PDF. Treat them as one document.
+    """
+)
+
+
+questions_per_page = 3.0  # Running average over this process's extractions, used to estimate an exam's size
+
+
+def observe_density(page_count: int, question_count: int):
+    global questions_per_page
+    if page_count and question_count:
+        questions_per_page = 0.8 * questions_per_page + 0.2 * question_count / page_count
+
+
+class ExtractionProgress:
+    """Questions streamed so far by the page chunks of one extraction (what on_progress receives)."""
+
+    def __init__(self, processor, chunks: list, callback):
+        self.processor = processor
+        self.page_count = chunks[-1][1]
+        self.chunk_questions = [[] for _ in chunks]
+        self.chunk_done = [False] * len(chunks)
+        self.test_data = None
+        self.callback = callback
+
+    async def add(self, index: int, kind: str, item: dict):
+        try:
+            if kind == "test_data":
+                self.test_data = self.test_data or TestMeta.model_validate(item)
+                return
+            self.chunk_questions[index].append(Questions.model_validate(item))
+        except ValueError:
+            return  # Incomplete object; the whole response is validated at the end
+        await self.callback(self)
+
+    def restart(self, index: int):
+        """Forget what a chunk streamed before its call was retried."""
+        self.chunk_questions[index] = []
+
+    @property
+    def found(self) -> int:
+        return sum(len(questions) for questions in self.chunk_questions)
+
+    @property
+    def expected(self) -> int:
+        """Estimated number of questions in the exam."""
+        return max(self.found, round(self.page_count * questions_per_page))
+
+    def snapshot(self) -> Main:
+        """
+        The questions so far in document order without gaps: every finished leading chunk and
+        the first unfinished one, merged like a finished extraction.
+        """
+        results = []
+        for questions, done in zip(self.chunk_questions, self.chunk_done):
+            results.append(Main(questions=[q.model_copy() for q in questions],
+                                test_data=self.test_data or TestMeta(test_description="", test_time=""),
+                                status="ok"))
+            if not done:
+                break
+        return merge_results(results)
+
+    async def snapshot_exam(self) -> dict:
+        """snapshot() in the storage format of Gimini_Proccess.format_exam."""
+        return await self.processor.format_exam(self.snapshot())
+
+
+async def prepare_pdf(file: bytes) -> dict:
+    """
+    Parse a PDF for extraction (text_layer.prepare with the chunking settings above).
+    A file pypdf cannot read becomes a single PDF part, so Gemini judges it.
+    """
+    try:
+        return await prepare(file, GEMINI_CHUNK_PAGES, GEMINI_CHUNK_OVERLAP)
+    except Exception:
+        return {"chunks": [(1, 0, [("pdf", file)])], "text_pages": 0, "scanned_pages": 0, "fingerprint": None}
 
 
 class Gimini_Proccess():
-    def __init__(self, file):
+    def __init__(self, file, on_progress=None, document: dict = None):
+        """
+        Args:
+            file: the PDF bytes.
+            on_progress: async callback receiving an ExtractionProgress whenever a question is
+                extracted; responses are streamed when it is given (and GEMINI_STREAM is on).
+            document: the file already parsed by prepare_pdf(), parsed by run() if not given.
+        """
         self.file = file
+        self.on_progress = on_progress if GEMINI_STREAM else None
+        self.progress = None
+        self.document = document
 
     async def run(self):
-        prompt = (
-            """Extract all closed questions with answer options from the provided exam PDF.
-            If the PDF is unrelated or does not contain exam questions, return {'status':'error'}. as JSON.
-
-            Rules:
-            - Copy the full question text, including any data, graphs, or tables.
-            - Remove all enumeration or label symbols like "a. ", "b. ", "א. ", etc. from the answers.
-            - Format code snippets or blocks with <pre dir="ltr" style="text-align:left"><code>put the code here</code></pre> tags, preserving tabs and whitespace. Add <br> tags to maintain line breaks.
-            - If the PDF is unrelated or does not contain exam questions, return {"test_data": "error"} as JSON.
-            - The output must be valid JSON exactly matching this schema:
-            - test_data: {
-                test_description: string (e.g., "Physics Exam | 21/06/2025") Do not change the language of the exam name, keep it as is.
-                test_time: string in Hours and minutes (e.g., "3:30 Hours")
-                }
-            - questions: list of objects with:
-                - question_number: integer
-                - question_data: string (full question text, excluding answers)
-                - answers: list of objects each with:
-                    - answer: string (clean answer text without enumeration)
-
-            Example Input:
-            Question 1: What is the speed of light?
-            a. 3 x 10^8 m/s
-            b. 1.5 x 10^8 m/s
-            c. 9.8 m/s^2
-
-            Example Output:
-            {
-            "test_data": {
-                "test_description": "Physics Exam | 21/06/2025",
-                "test_time": "3 Hours"
-            },
-            "questions": [
-                {
-                "question_number": 1,
-                "question_data": "What is the speed of light?",
-                "answers": [
-                    {"answer": "3 x 10^8 m/s"},
-                    {"answer": "1.5 x 10^8 m/s"},
-                    {"answer": "9.8 m/s^2"}
-                ]
-                }
-            ]
-            }
-
-            Now extract from the following PDF:"""
-        )
-        
-        response = await client.aio.models.generate_content(  
-            model="models/gemini-2.5-flash",
-            contents=[types.Part.from_bytes(data=self.file, mime_type='application/pdf'), prompt],
-            config={'response_mime_type': 'application/json', 'response_schema': Main}
-        )
-        return response.parsed
-
-
-    async def shuffle_exam(self, data: Main):
-        """Shuffles answers and returns data in a JSON-friendly format."""
-        shuffled_questions = []
-        # Access the Config object fields
-        test_data = {
-            "test_description": data.test_data.test_description,
-            "test_time": data.test_data.test_time
-        }
-        for item in data.questions:
-            question_number = item.question_number
-            question_data = item.question_data
-            correct_answer = item.answers[0]  # Corrected line.
-
-            # Shuffle answers
-            answers_list = copy.deepcopy(item.answers)
-            random.shuffle(answers_list)
-            item.answers = answers_list
-
-            shuffled_questions.append({
-                "question_number": question_number,
-                "question_data": question_data,
-                "answers": item.answers,
-                "correct_answer": correct_answer,
+        """
+        Extract the exam. Pages with a usable text layer are sent as text (gimini/text_layer.py),
+        and large PDFs are split into page chunks extracted concurrently.
+        """
+        document = self.document or await prepare_pdf(self.file)
+        PDF_PAGES.inc(document["text_pages"], kind="text")
+        PDF_PAGES.inc(document["scanned_pages"], kind="pdf")
+
+        chunks = document["chunks"]
+        if self.on_progress:
+            self.progress = ExtractionProgress(self, chunks, self.on_progress)
+        if len(chunks) == 1:
+            result = await self.extract(chunks[0][2])
+        else:
+            result = await self.run_chunked(chunks)
+        if result and result.questions:
+            observe_density(chunks[-1][1], len(result.questions))
+        return result
+
+    async def extract(self, parts: list, note: str = "", index: int = 0) -> Main:
+        """
+        Send one document (or page chunk) to Gemini, limited by GEMINI_MAX_CONCURRENCY.
+        Args:
+            parts: ("text", str) and ("pdf", bytes) pieces in page order, from text_layer.prepare().
+            note: instructions for this call, put before the extraction prompt.
+            index: the chunk's position, for progress reporting.
+        The extraction prompt comes from the prompt cache when one is available, and
+        is sent inline after `note` otherwise.
+        """
+        from google.genai import errors, types
+        client = get_client()
+        contents = [types.Part.from_bytes(data=data, mime_type='application/pdf') if kind == "pdf" else data
+                    for kind, data in parts]
+        if any(kind == "text" for kind, _ in parts):
+            note = TEXT_LAYER_PROMPT + note
+        config = {'response_mime_type': 'application/json', 'response_schema': Main}
+        on_item = None
+        if self.progress:
+            async def on_item(kind, item):
+                await self.progress.add(index, kind, item)
+        cache_name = await prompt_cache.get(client)
+        result = None
+        if cache_name:
+            try:
+                result = await self.generate(client, contents + [note] if note else contents,
+                                             {**config, 'cached_content': cache_name}, cached=True, on_item=on_item)
+            except errors.ClientError as e:
+                if e.code != 404 and "cache" not in str(e).lower():
+                    raise
+                # Expired or deleted between the lookup and the call; this call goes inline
+                logger.warning("Gemini prompt cache %s rejected (%s), sending the prompt inline", cache_name, e.code)
+                prompt_cache.invalidate(cache_name)
+                cache_name = None
+                if self.progress:
+                    self.progress.restart(index)
+        if not cache_name:
+            result = await self.generate(client, contents + [note + EXTRACTION_PROMPT], config, cached=False,
+                                         on_item=on_item)
+        if self.progress:
+            self.progress.chunk_done[index] = True
+        return result
+
+    async def generate(self, client, contents: list, config: dict, cached: bool, on_item=None) -> Main:
+        """One Gemini call; streamed when on_item is given, which then receives each completed question."""
+        async with gemini_semaphore:
+            started = time.perf_counter()
+            try:
+                if on_item is None:
+                    response = await client.aio.models.generate_content(model=GEMINI_MODEL, contents=contents,
+                                                                        config=config)
+                    parsed = response.parsed
+                else:
+                    parsed, response = await self.stream(client, contents, config, on_item)
+            except Exception:
+                GEMINI_CALLS.inc(outcome="error")
+                raise
+            finally:
+                GEMINI_SECONDS.observe(time.perf_counter() - started)
+        GEMINI_CALLS.inc(outcome="ok")
+        tokens = record_usage(response)
+        logger.info("Gemini call (%s prompt): %d prompt tokens, %d cached, %d uncached, %d output",
+                    "cached" if cached else "inline", tokens.get("prompt", 0), tokens.get("cached", 0),
+                    tokens.get("uncached", 0), tokens.get("output", 0))
+        return parsed
+
+    async def stream(self, client, contents: list, config: dict, on_item) -> tuple:
+        """
+        Stream a response, passing each question to on_item as soon as its JSON object is complete.
+        Returns:
+            tuple: (parsed Main or None, last chunk, which carries the usage metadata)
+        """
+        parser = QuestionStreamParser()
+        response = None
+        async for response in await client.aio.models.generate_content_stream(model=GEMINI_MODEL,
+                                                                              contents=contents, config=config):
+            for kind, item in parser.feed(response.text or ""):
+                await on_item(kind, item)
+        try:
+            return Main.model_validate_json(parser.text), response
+        except ValueError:
+            return None, response  # Like response.parsed for a response that does not match the schema
+
+    async def run_chunked(self, chunks: list) -> Main:
+        """Extract overlapping page ranges concurrently and merge them into a single exam."""
+        results = await asyncio.gather(*(
+            self.extract(parts, CHUNK_PROMPT.format(first=first, last=last), index)
+            for index, (first, last, parts) in enumerate(chunks)
+        ))
+        return merge_results(results)
+
+
+    async def format_exam(self, data: Main):
+        """
+        Returns the exam in the compact v2 format, answers in their canonical (extracted) order:
+        plain strings, with the correct answer as an index into them.
+        Answers are shuffled per practice attempt when the exam is viewed (utils/shuffle.py).
+        """
+        dumped = data.model_dump()  # One pass over the model instead of .dict() per nested object
+        questions = []
+        for item in dumped["questions"]:
+            answers = [answer["answer"] for answer in item["answers"]]
+            if not answers:
+                continue
+            questions.append({
+                "question_number": item["question_number"],
+                "question_data": item["question_data"],
+                "answers": answers,
+                "correct_index": 0,  # The exams list the correct answer first
             })
 
         return {
-            "test_data": test_data,  # Now a dict with description and time
-            "questions": shuffled_questions 
+            "schema_version": EXAM_SCHEMA_VERSION,
+            "test_data": dumped["test_data"],  # Dict with description and time
+            "questions": questions
         }
     
     async def call_gimini_progress(self):
-        """Sending Request to gimini and suffle the exam"""
+        """Sending Request to gimini and format the exam for storage"""
         try:
             data = await self.run()
-            if data.status == "error":
+            if not data or data.status == "error":
                 return False
-            
-            return await self.shuffle_exam(data)
+
+            with metrics.span("job", "format_exam"):
+                return await self.format_exam(data)
         
         except Exception as e:
             raise e
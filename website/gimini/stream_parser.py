@@ -0,0 +1,72 @@
+"""
+Incremental parser for the streamed extraction JSON.
+
+Gemini streams the `Main` JSON in arbitrary text fragments. The parser scans each
+fragment once, tracking strings and nesting, and returns every object that has
+just been completed inside the top-level "questions" array (and "test_data"),
+so questions can be shown before the response ends.
+"""
+import json
+from typing import List, Tuple
+
+
+class QuestionStreamParser:
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0  # Next character of buffer to scan
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.last_key = None  # Last string seen directly in the top-level object
+        self.in_questions = False
+        self.item_start = None
+
+    def feed(self, text: str) -> List[Tuple[str, dict]]:
+        """
+        Add a fragment of the response.
+        Returns:
+            list: ("question", dict) and ("test_data", dict) for every object completed by this fragment.
+        """
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+        for i in range(self.position, len(buffer)):
+            ch = buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_key = buffer[self.string_start + 1:i]
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = i
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth == 2 and ch == "[" and self.last_key == "questions":
+                    self.in_questions = True
+                elif (self.depth == 2 and ch == "{" and self.last_key == "test_data") or \
+                        (self.depth == 3 and ch == "{" and self.in_questions):
+                    self.item_start = i
+            elif ch in "}]":
+                if self.item_start is not None and ch == "}" and self.depth in (2, 3):
+                    kind = "question" if self.in_questions else "test_data"
+                    try:
+                        completed.append((kind, json.loads(buffer[self.item_start:i + 1])))
+                    except ValueError:
+                        pass  # Left to the validation of the whole response
+                    self.item_start = None
+                if self.depth == 2 and ch == "]":
+                    self.in_questions = False
+                self.depth -= 1
+        self.position = len(buffer)
+        return completed
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return self.buffer
@@ -0,0 +1,169 @@
+"""
+Local text-layer extraction before a PDF is sent to Gemini.
+
+Born-digital exams carry a text layer that pypdf reads in milliseconds, and
+plain text is far cheaper and faster for Gemini than its document-vision path.
+Each page is classified:
+    text:    enough readable text, no embedded images or figures and few drawing operators;
+             sent as text under a "--- Page N ---" header.
+    scanned: little or unreadable text, images (scans, figures) or many drawing
+             operators (vector graphs); sent as PDF, each run of consecutive
+             such pages as one PDF part, in page order.
+
+The same pass fingerprints the text of every page (gimini/fingerprint.py) so
+near-duplicate uploads can be spotted before anything is sent to Gemini.
+Parsing runs in a process pool so large PDFs do not hold the GIL of the server.
+pypdf is imported by prepare_document, in the pool, so importing the app does not load it.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import groupby
+from typing import List, Optional
+import asyncio
+import io
+import multiprocessing
+import os
+import re
+import threading
+
+from .chunking import page_ranges
+from .fingerprint import NEAR_DUPLICATE_DETECTION, fingerprint
+
+GEMINI_TEXT_LAYER = os.environ.get("GEMINI_TEXT_LAYER", "1") == "1"  # Send text instead of PDF for pages with a text layer
+TEXT_LAYER_WORKERS = int(os.environ.get("TEXT_LAYER_WORKERS", "2"))  # Processes parsing PDFs, 0 parses in a thread
+TEXT_PAGE_MIN_CHARS = int(os.environ.get("TEXT_PAGE_MIN_CHARS", "200"))  # Fewer characters means a scanned page
+TEXT_PAGE_MAX_DRAW_OPS = int(os.environ.get("TEXT_PAGE_MAX_DRAW_OPS", "150"))  # More path operators means a figure
+TEXT_PAGE_MIN_READABLE = 0.6  # Share of letters, digits and whitespace below which the text is garbled (bad font maps)
+
+DRAW_OPERATOR = re.compile(rb"(?<![A-Za-z])(?:l|c|v|y|re)(?![A-Za-z])")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _readable_share(text: str) -> float:
+    return sum(ch.isalnum() or ch.isspace() for ch in text) / len(text)
+
+
+def _image_count(page) -> int:
+    resources = page.get("/Resources") or {}
+    xobjects = resources.get("/XObject") or {}
+    return sum(1 for obj in xobjects.values() if obj.get_object().get("/Subtype") in ("/Image", "/Form"))
+
+
+def _draw_ops(page) -> int:
+    contents = page.get_contents()
+    return len(DRAW_OPERATOR.findall(contents.get_data())) if contents is not None else 0
+
+
+def extract_text(page) -> str:
+    try:
+        return (page.extract_text() or "").strip()
+    except Exception:
+        return ""  # Anything pypdf cannot read is left to Gemini
+
+
+def page_text(page, text: str = None) -> Optional[str]:
+    """
+    The page's text if it can stand in for the page, None if the page must be sent as PDF.
+    Args:
+        text: the page's extract_text(), extracted here if not given.
+    """
+    if text is None:
+        text = extract_text(page)
+    try:
+        if len(text) < TEXT_PAGE_MIN_CHARS or _readable_share(text) < TEXT_PAGE_MIN_READABLE or "(cid:" in text:
+            return None
+        if _image_count(page) or _draw_ops(page) > TEXT_PAGE_MAX_DRAW_OPS:
+            return None
+    except Exception:
+        return None  # Anything pypdf cannot read is left to Gemini
+    return text
+
+
+def _subset(reader, pages: List[int]) -> bytes:
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(reader.pages[page])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def prepare_document(file_bytes: bytes, chunk_pages: int = 0, overlap: int = 0, text_layer: bool = True,
+                     with_fingerprint: bool = False) -> dict:
+    """
+    Split a PDF into chunks of Gemini parts.
+    Args:
+        chunk_pages: pages per chunk, 0 (or a shorter PDF) gives a single chunk.
+        text_layer: classify pages; False sends every page as PDF.
+        with_fingerprint: also fingerprint the text of all pages.
+    Returns:
+        dict: {"chunks": [(first_page, last_page, parts)], "text_pages": int, "scanned_pages": int,
+        "fingerprint": dict | None}, where parts is a list of ("text", str) and ("pdf", bytes) in page order.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(file_bytes))
+    raw_texts = [extract_text(page) for page in reader.pages] if text_layer or with_fingerprint else None
+    texts = [page_text(page, raw_texts[number]) if text_layer else None for number, page in enumerate(reader.pages)]
+    page_count = len(texts)
+    if chunk_pages > 0 and page_count > chunk_pages:
+        ranges = page_ranges(page_count, chunk_pages, overlap)
+    else:
+        ranges = [range(page_count)]
+
+    chunks = []
+    for pages in ranges:
+        parts = []
+        for scanned, run in groupby(pages, key=lambda page: texts[page] is None):
+            run = list(run)
+            if not scanned:
+                parts.append(("text", "\n\n".join(f"--- Page {page + 1} ---\n{texts[page]}" for page in run)))
+            elif len(run) == page_count:
+                parts.append(("pdf", file_bytes))  # Nothing to gain from rewriting the whole file
+            else:
+                parts.append(("pdf", _subset(reader, run)))
+        chunks.append((pages.start + 1, pages.stop, parts or [("pdf", file_bytes)]))
+
+    text_pages = sum(text is not None for text in texts)
+    return {"chunks": chunks, "text_pages": text_pages, "scanned_pages": page_count - text_pages,
+            "fingerprint": fingerprint(raw_texts) if with_fingerprint else None}
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if TEXT_LAYER_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned, not forked: forking a process that runs the event loop and the
+                # Firebase I/O threads can copy a held lock into the child and deadlock it
+                _pool = ProcessPoolExecutor(max_workers=TEXT_LAYER_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def prepare(file_bytes: bytes, chunk_pages: int, overlap: int) -> dict:
+    """prepare_document() off the event loop, in the process pool when there is one."""
+    args = (prepare_document, file_bytes, chunk_pages, overlap, GEMINI_TEXT_LAYER, NEAR_DUPLICATE_DETECTION)
+    pool = get_pool()
+    if pool is None:
+        return await asyncio.to_thread(*args)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a new pool for the next upload
+        shutdown_pool()
+        return await asyncio.to_thread(*args)
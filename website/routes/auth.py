@@ -1,12 +1,11 @@
 from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import RedirectResponse
 from urllib.parse import urlencode
-import httpx
 from datetime import datetime, timedelta
 from jose import jwt
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
-from website.firebase import db
+from website.firebase.storage import reference
+from website.utils.auth import verify_google_id_token
+from website.utils.http_client import get_http_client
 import os
 
 router = APIRouter()
@@ -50,10 +49,8 @@ async def callback(request: Request):
         "grant_type": "authorization_code"
     }
 
-    # Proper async POST request without async with
-    async_client = httpx.AsyncClient()
-    token_response = await async_client.post(token_url, data=data)
-    await async_client.aclose()
+    # Pooled app-wide client: logins reuse warm connections to Google
+    token_response = await get_http_client().post(token_url, data=data)
 
     if token_response.status_code != 200:
         raise HTTPException(status_code=400, detail="Failed to get token from Google")
@@ -64,8 +61,8 @@ async def callback(request: Request):
         raise HTTPException(status_code=400, detail="ID token missing from response")
 
     try:
-        idinfo = id_token.verify_oauth2_token(id_token_str,
-        google_requests.Request(),
+        # Verified against Google's cached certs instead of fetching them on every login
+        idinfo = await verify_google_id_token(id_token_str,
         GOOGLE_CLIENT_ID,
         clock_skew_in_seconds=5)  # Allow a small clock skew
     except Exception as e:
@@ -75,8 +72,8 @@ async def callback(request: Request):
     email = idinfo.get("email")
     name = idinfo.get("name", "")
 
-    user_ref = db.reference(f"users/{user_id}")
-    user_ref.update({
+    user_ref = reference(f"users/{user_id}")
+    await user_ref.update({
         "email": email,
         "name": name,
         "last_login": datetime.utcnow().isoformat()
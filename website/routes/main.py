@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, Cookie, HTTPException,status,UploadFile,BackgroundTasks,WebSocket,WebSocketDisconnect
-from fastapi.responses import RedirectResponse, HTMLResponse,JSONResponse
-from typing import Optional
+from fastapi import APIRouter, Depends, Cookie, HTTPException,status,UploadFile,WebSocket,WebSocketDisconnect,Query
+from fastapi.responses import RedirectResponse, HTMLResponse,JSONResponse,Response,PlainTextResponse
+from typing import List, Optional
+import asyncio
 import os 
 
 import uuid
@@ -8,15 +9,32 @@ from fastapi.templating import Jinja2Templates
 from fastapi import Request
 from .. import templates
 
-from ..utils.upload_file import FileUpload
+from ..utils.upload_file import FileUpload, BATCH_MAX_FILES
 from ..gimini.runner import Gimini_Proccess
-from ..firebase.Exam import db, UploadExamToDB, GetExamFromDB
-from ..utils.jobs import UploadExamJobs
+from ..firebase.Exam import UploadExamToDB, GetExamFromDB
+from ..utils.jobs import UploadExamJobs, UploadJobGroup
+from ..utils.job_queue import job_queue, QueueFull
 from ..utils.auth import get_current_user
+from ..utils.shuffle import new_seed, valid_seed, shuffle_questions
+from ..utils.cache import TTLCache
+from ..utils.http_cache import make_etag, etag_matches
+from ..firebase.exam_format import content_version
 router = APIRouter()
-from .. import connections
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
+from ..utils.notify import bus, GroupSocket
+from ..utils.warmup import warm_clients
+from ..utils import metrics
+from ..utils.metrics import span
 URL = os.environ.get("URL")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # When set, /metrics requires "Authorization: Bearer <token>"
+EXAM_PAGE_CACHE_SIZE = int(os.environ.get("EXAM_PAGE_CACHE_SIZE", "256"))  # Rendered exam bodies kept in memory
+EXAM_PAGE_CACHE_TTL = float(os.environ.get("EXAM_PAGE_CACHE_TTL", "600"))  # Seconds
+EXAM_QUESTION_BATCH = int(os.environ.get("EXAM_QUESTION_BATCH", "10"))  # Questions embedded in the exam page and fetched per request
+EXAM_API_MAX_LIMIT = int(os.environ.get("EXAM_API_MAX_LIMIT", "50"))  # Largest page /api/exam/{id}/questions serves
+
+# (exam_id, content version, seed) -> rendered exam-data fragment, kept only for requests that carry
+# their seed (reloads, back navigation, shared attempt links); a freshly picked seed is never seen again
+exam_body_cache = TTLCache(EXAM_PAGE_CACHE_SIZE, EXAM_PAGE_CACHE_TTL)
+metrics.watch_cache("exam_body", exam_body_cache)
 
 
 
@@ -35,6 +53,25 @@ def head_home():
             "Cache-Control": "no-cache"
         }
     )
+@router.get("/ready")
+async def ready():
+    """
+    Readiness probe. Initializes the Firebase and Gemini clients if startup has not
+    done it yet, and reports 503 until both are usable.
+    """
+    checks = await warm_clients()
+    ok = all(result == "ok" for result in checks.values())
+    return JSONResponse(status_code=200 if ok else 503, content={"status": "ready" if ok else "not ready", **checks})
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint(request: Request):
+    """Prometheus scrape endpoint for this process."""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/", response_class=HTMLResponse)
 def home(request: Request, user=Depends(get_current_user)):
     if user:
@@ -43,14 +80,14 @@ def home(request: Request, user=Depends(get_current_user)):
     return templates.TemplateResponse("/home.html",{ "request": request })
 
 @router.get("/dashboard", response_class=HTMLResponse)
-def dashboard(user=Depends(get_current_user), request: Request = None):
+async def dashboard(user=Depends(get_current_user), request: Request = None):
     if not user:
         raise HTTPException(
             status_code=status.HTTP_307_TEMPORARY_REDIRECT,
             detail="Not authenticated",
             headers={"Location": "/"}
         )
-    user_exams = GetExamFromDB(user).get_exams()
+    user_exams = await GetExamFromDB(user).get_exam_summaries()
     return templates.TemplateResponse("dashboard.html", {
         "URL":URL,
         "request": request,
@@ -61,18 +98,84 @@ def dashboard(user=Depends(get_current_user), request: Request = None):
 
 
 @router.get("/exam/{exam_id}", response_class=HTMLResponse)
-async def exam_detail(user=Depends(get_current_user), request: Request = None, exam_id: str = None):
+async def exam_detail(user=Depends(get_current_user), request: Request = None, exam_id: str = None,
+                      seed: Optional[str] = None):
     """
     Display exam details and questions.
+    Answers are shuffled per attempt from `seed`; a new seed is picked when it is missing
+    and the page puts it in the URL so a reload shows the same order.
+    Only the first EXAM_QUESTION_BATCH questions are embedded; the page fetches the rest
+    from /api/exam/{exam_id}/questions in the background.
+    The page carries a strong ETag (exam, content version, seed and the user shown in the
+    header) so revisits are answered with 304, and the shuffled exam-data fragment of a
+    request with a seed is cached so a repeat render skips shuffling and serialization.
     """
     # Fetch exam details from the database
-    exam_details = GetExamFromDB(user).get_exam_details_by_exam_id(exam_id)
+    exam_details = await GetExamFromDB(user).get_exam_details_by_exam_id(exam_id)
     if not exam_details:
         raise HTTPException(status_code=404, detail="Exam not found")
+    seeded = valid_seed(seed)
+    if not seeded:
+        seed = new_seed()
+    name = user.get("name") if user else None
+    version = content_version(exam_details)
+    etag = make_etag(exam_id, version, seed, user.get("sub") if user else None, name)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Cookie"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    body_key = (exam_id, version, seed)
+    exam_body = exam_body_cache.get(body_key)
+    if exam_body is None:
+        data = exam_details.get("data") or {}
+        questions = data.get("questions") or []
+        exam_view = {**exam_details, "data": {
+            **data,
+            "questions": shuffle_questions(questions[:EXAM_QUESTION_BATCH], seed),
+            "question_total": len(questions),
+            "batch_size": EXAM_QUESTION_BATCH
+        }}
+        exam_body = templates.get_template("partials/exam_data.html").render(exam=exam_view)
+        if seeded:
+            exam_body_cache.set(body_key, exam_body)
     return templates.TemplateResponse("exam.html", {
         "request": request,
-        "name": user.get("name") if user else None,  
-        "exam": exam_details,})
+        "name": name,
+        "exam_id": exam_id,
+        "exam_body": exam_body,
+        "seed": seed,}, headers=headers)
+
+
+@router.get("/api/exam/{exam_id}/questions", response_class=JSONResponse)
+async def exam_questions(request: Request, exam_id: str, seed: str,
+                         offset: int = Query(0, ge=0),
+                         limit: int = Query(EXAM_QUESTION_BATCH, ge=1, le=EXAM_API_MAX_LIMIT),
+                         user=Depends(get_current_user)):
+    """
+    Return a page of an exam's questions, with answers shuffled for the attempt's seed.
+    Questions keep their index in the whole exam, so pages match the order in the exam page.
+    """
+    if not valid_seed(seed):
+        raise HTTPException(status_code=400, detail="Invalid seed")
+    exams = GetExamFromDB(user)
+    exam_details = await exams.get_exam_details_by_exam_id(exam_id)
+    if not exam_details:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    etag = make_etag(exam_id, content_version(exam_details), seed, offset, limit)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    page = await exams.get_exam_questions(exam_id, offset, limit)  # Served from the details cache
+    if page is None:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    questions, total = page
+    next_offset = offset + len(questions)
+    return JSONResponse(content={
+        "offset": offset,
+        "total": total,
+        "next_offset": next_offset if next_offset < total else None,
+        "questions": shuffle_questions(questions, seed, start=offset)
+    }, headers=headers)
 
 
 @router.delete("/delete_exam/{exam_id}", response_class=JSONResponse)
@@ -89,7 +192,7 @@ async def delete_exam(user=Depends(get_current_user), exam_id: str = None):
     if not exam_id:
         raise HTTPException(status_code=400, detail="Exam ID is required")
     try:
-        result =  GetExamFromDB(user).delete_exam(exam_id)
+        result = await GetExamFromDB(user).delete_exam(exam_id)
         if result:
             return JSONResponse(status_code=200, content={"detail": "Exam deleted successfully"})
         else:
@@ -100,7 +203,6 @@ async def delete_exam(user=Depends(get_current_user), exam_id: str = None):
 
 @router.post("/upload-pdf")
 async def upload_pdf(
-    background_tasks: BackgroundTasks,
     file: UploadFile,
     request: Request = None,
     user: Optional[dict] = Depends(get_current_user),
@@ -108,35 +210,166 @@ async def upload_pdf(
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    file_content = await file.read()
-    file_size = len(file_content)
-    job_id = str(uuid.uuid4())
+    if not file.filename or not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
+    job_id = str(uuid.uuid4())
     uploader = UploadExamToDB(user)
     job = UploadExamJobs(job_id)
-    check_max = await uploader.check_max_exams()
-    file_hash = await FileUpload(file_content, file_size).hash_file()
-    same_exam_exists_in_userDB= await uploader.same_exam_exists(file_hash)
-    exam_exists_on_other_users = await uploader.exam_exists_on_other_user(file_hash)
-
-    if not check_max:
-        raise HTTPException(status_code=403, detail="You can only upload up to 6 exams.")
-    if file_size == 0:
-        raise HTTPException(status_code=400, detail="File is empty")
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="File size exceeds the maximum limit of 10MB")
-    if not file.filename.endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
-    if same_exam_exists_in_userDB:
-        raise HTTPException(status_code=400, detail="This Exam Already exists")
-    if exam_exists_on_other_users: # if exam already exists on other users set status to done      
-        await job.set_job_status("done", user["sub"])
-        return {"job_id": job_id, "status": "done"}
-    
+    try:
+        # Pre-flight: stream the file to the job spool (size, magic bytes and hash
+        # checked on the way), then one compact read of the user's summary
+        upload = FileUpload()
+        with span("upload", "stream_to_spool"):
+            error = await upload.stream_to_file(file, job.spool_path)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+        file_hash = upload.file_hash
+
+        with span("upload", "dedupe_checks"):
+            summary = await uploader.get_exam_summary()
+            if not await uploader.check_max_exams(summary):
+                raise HTTPException(status_code=403, detail="You can only upload up to 6 exams.")
+            if await uploader.same_exam_exists(file_hash, summary):
+                raise HTTPException(status_code=400, detail="This Exam Already exists")
+            linked = await uploader.link_existing_exam(file_hash)
+        if linked: # if exam already exists on other users set status to done
+            await job.discard_upload()
+            await job.set_job_status("done", user["sub"], linked)
+            return {"job_id": job_id, "status": "done", **linked}
+
+        with span("upload", "create_job"):
+            await job.create_job(user, file_hash, file.filename)
+        try:
+            position = await job_queue.submit(job_id, user, file_hash)
+        except QueueFull:
+            await job.delete_job()
+            raise_queue_full()
+        if position is None:
+            # Same file is already being extracted, share its result
+            await job.discard_upload()
+            return {"job_id": job_id, "status": "processing"}
+    except HTTPException:
+        await job.discard_upload()
+        raise
+    return {"job_id": job_id, "status": "processing", "queue_position": position}
+
+
+def raise_queue_full():
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many exams are being processed right now, please try again in a minute",
+        headers={"Retry-After": "30"}
+    )
+
+
+@router.post("/upload-pdfs")
+async def upload_pdfs(
+    files: List[UploadFile],
+    user: Optional[dict] = Depends(get_current_user),
+):
+    """
+    Upload several exams in one request.
+    Every file is hashed while it is spooled, duplicates are resolved with one summary read
+    and one concurrent round of blob lookups, and the quota is checked once for the batch.
+    The files left to extract become jobs of one group, run concurrently by the job queue
+    workers and followed together on /ws/group/{group_id}.
+    Returns:
+        dict: {"group_id", "files"}, one entry per file in upload order with its "filename" and
+        "status": "processing" (with "job_id"), "done" (with "examId", "examName") or
+        "rejected" (with "detail").
+    """
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"You can upload up to {BATCH_MAX_FILES} files at once")
+
+    uploader = UploadExamToDB(user)
+    group_id = str(uuid.uuid4())
+    results = [{"filename": file.filename} for file in files]
+    jobs = [UploadExamJobs(str(uuid.uuid4())) for _ in files]
+    hashes = {}  # index -> file hash of the files still accepted
+
+    def reject(index: int, detail: str):
+        results[index].update(status="rejected", detail=detail)
+        hashes.pop(index, None)
+
+    try:
+        with span("batch_upload", "stream_to_spool"):
+            for index, file in enumerate(files):
+                if not file.filename or not file.filename.endswith('.pdf'):
+                    reject(index, "Only PDF files are allowed")
+                    continue
+                upload = FileUpload()
+                error = await upload.stream_to_file(file, jobs[index].spool_path)
+                if error:
+                    reject(index, error)
+                elif upload.file_hash in hashes.values():
+                    reject(index, "This file appears more than once in the upload")
+                else:
+                    hashes[index] = upload.file_hash
+
+        with span("batch_upload", "dedupe_checks"):
+            summary, existing = await asyncio.gather(
+                uploader.get_exam_summary(),
+                uploader.find_existing_exams(list(hashes.values()))
+            )
+            owned = {exam.get("file_hash") for exam in summary.values()}
+            remaining = uploader.MAX_EXAMS - len(summary)
+            for index, file_hash in list(hashes.items()):
+                if file_hash in owned:
+                    reject(index, "This Exam Already exists")
+                elif remaining <= 0:
+                    reject(index, f"You can only upload up to {uploader.MAX_EXAMS} exams.")
+                else:
+                    remaining -= 1
+
+        # Check capacity before writing anything, so a full queue rejects the batch as a whole
+        to_extract = [index for index, file_hash in hashes.items() if file_hash not in existing]
+        if sum(hashes[index] not in job_queue.inflight for index in to_extract) > job_queue.free_slots():
+            raise_queue_full()
+
+        with span("batch_upload", "link_existing"):
+            linkable = [index for index in hashes if index not in to_extract]
+            linked = await asyncio.gather(*(
+                uploader.link_existing_exam(hashes[index], existing[hashes[index]]) for index in linkable))
+            for index, result in zip(linkable, linked):
+                if result:
+                    results[index].update(status="done", **result)
+                    del hashes[index]
+                else:
+                    to_extract.append(index)  # Claimed by a delete in the meantime, extract it again
 
-    await job.set_job_status("processing", user["sub"])
-    background_tasks.add_task(job.process_and_notify, job_id, user, file_content, file_size, file_hash, file.filename)
-    return {"job_id": job_id, "status": "processing"}
+        with span("batch_upload", "create_jobs"):
+            group_jobs = {jobs[index].job_id: files[index].filename for index in to_extract}
+            if group_jobs:
+                await asyncio.gather(
+                    UploadJobGroup(group_id).create(user["sub"], group_jobs),
+                    *(jobs[index].create_job(user, hashes[index], files[index].filename, group_id)
+                      for index in to_extract)
+                )
+        for index in sorted(to_extract):
+            job = jobs[index]
+            try:
+                position = await job_queue.submit(job.job_id, user, hashes[index])
+            except QueueFull:  # Filled up by another upload since the capacity check
+                await job.delete_job()
+                reject(index, "Too many exams are being processed right now, please try again in a minute")
+                continue
+            if position is None:
+                await job.discard_upload()  # Same file is already being extracted, share its result
+                results[index].update(status="processing", job_id=job.job_id)
+                continue
+            results[index].update(status="processing", job_id=job.job_id, queue_position=position)
+    except HTTPException:
+        await asyncio.gather(*(job.discard_upload() for job in jobs))
+        raise
+    # Spooled files that did not become jobs (rejected or linked)
+    await asyncio.gather(*(jobs[index].discard_upload() for index, result in enumerate(results)
+                           if result.get("status") != "processing"))
+    return {"group_id": group_id if any("job_id" in result for result in results) else None, "files": results}
 
 
 
@@ -155,15 +388,74 @@ async def websocket_endpoint(websocket: WebSocket, job_id: str, user: Optional[d
         return
 
     await websocket.accept()
-    connections[job_id] = websocket
+    bus.register(job_id, websocket)
+    # The job may have finished between the ownership check and registering the socket
+    data = await job.get_job_status()
+    if data and data.get("status") in ("done", "error"):
+        await bus.deliver(job_id, data["status"])
     try:
         while True:
             message = await websocket.receive_text()  # keep alive
             if message == "ack":
-                db.reference('jobs').child(job_id).delete()
+                await job.delete_job()
                 
     except WebSocketDisconnect:
-        connections.pop(job_id, None)
+        bus.unregister(job_id, websocket)
+
+@router.websocket("/ws/group/{group_id}")
+async def group_websocket_endpoint(websocket: WebSocket, group_id: str, user: Optional[dict] = Depends(get_current_user)):
+    """
+    WebSocket for every job of a batch upload. Each job's messages are sent as JSON tagged with
+    its id ({"job_id", "type": "done" | "error" | "progress", ...}); "ack" from the frontend,
+    once it has every result, deletes the group and its jobs.
+    """
+    if not user:
+        await websocket.close(code=1008)  # Policy Violation
+        return
+    group = UploadJobGroup(group_id)
+    data = await group.get()
+    if not data or data.get("user_id") != user["sub"]:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    job_ids = list(data.get("jobs") or {})
+    sockets = {job_id: GroupSocket(websocket, job_id) for job_id in job_ids}
+    for job_id, socket in sockets.items():
+        bus.register(job_id, socket)
+    # Jobs may have finished before the socket was registered
+    for job_id, record in (await group.get_job_statuses(job_ids)).items():
+        if record and record.get("status") in ("done", "error"):
+            await bus.deliver(job_id, record["status"])
+    try:
+        while True:
+            message = await websocket.receive_text()  # keep alive
+            if message == "ack":
+                await group.delete(job_ids)
+    except WebSocketDisconnect:
+        for job_id, socket in sockets.items():
+            bus.unregister(job_id, socket)
+
+
+@router.get("/job-group/{group_id}")
+async def get_job_group_route(group_id: str, user: Optional[dict] = Depends(get_current_user)):
+    """Get the status of every job of a batch upload: {"group_id", "jobs": {job_id: job record}}."""
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    group = UploadJobGroup(group_id)
+    data = await group.get()
+    if not data:
+        raise HTTPException(status_code=404, detail="Job group not found")
+    if data.get("user_id") != user["sub"]:
+        raise HTTPException(status_code=403, detail="Forbidden: You do not own this job group")
+
+    jobs = data.get("jobs") or {}
+    records = await group.get_job_statuses(list(jobs))
+    return {"group_id": group_id, "jobs": {
+        job_id: {"filename": filename, **(records.get(job_id) or {"status": "unknown"})}
+        for job_id, filename in jobs.items()
+    }}
+
 
 @router.get("/job-status/{job_id}")
 async def get_job_status_route(job_id: str, user: Optional[dict] = Depends(get_current_user)):
@@ -15,7 +15,9 @@ document.addEventListener("DOMContentLoaded", () => {
   const form = document.getElementById('pdf-upload-form');
   const URL = window.location.origin; // Base URL for your application
   let selectedFile = null;
+  let selectedFiles = [];  // More than one file goes to /upload-pdfs as one batch
   let uploadController = null;
+  let loadingCardCount = 0;
 
   // ======= ADDED FOR WEBSOCKET & JOB STATUS =======
   let currentLoadingCardId = null;
@@ -38,6 +40,9 @@ document.addEventListener("DOMContentLoaded", () => {
 
       if (data.status === "processing") {
         createLoadingExamCard("Uploading Exam...");
+        if (data.progress) {
+          updateLoadingCardProgress({ ...data.progress, examId: data.partial_exam_id });
+        }
         connectWebSocket();
       } else if (data.status === "done") {
         updateLoadingCardToSuccess(jobId, data.result.examName);
@@ -56,7 +61,12 @@ function connectWebSocket() {
     ws = new WebSocket(`ws://${window.location.host}/ws/${jobId}`); //PRODUCTION-FLAG
 
     ws.onmessage = async (event) => {
-        if (event.data === "done") {
+        if (event.data.startsWith("{")) {
+            // Progress while Gemini streams: {"type": "progress", "questions", "expected", "examId"}
+            const message = JSON.parse(event.data);
+            if (message.type === "progress") updateLoadingCardProgress(message);
+        }
+        else if (event.data === "done") {
             // 1. Try to fetch job status until it's "done" or max retries reached
             let maxRetries = 10;
             let delayMs = 500;
@@ -97,6 +107,116 @@ function connectWebSocket() {
     };
 }
 
+  // ======= BATCH UPLOADS: one job group, one WebSocket =======
+  async function restoreGroupStatus() {
+    const groupId = localStorage.getItem('groupId');
+    if (!groupId) return;
+
+    try {
+      const res = await fetch(`/job-group/${groupId}`);
+      if (!res.ok) throw new Error("Job group not found");
+      const data = await res.json();
+      const jobCards = {};
+      for (const [id, job] of Object.entries(data.jobs)) {
+        jobCards[id] = createLoadingExamCard(job.filename);
+        if (job.progress) {
+          updateLoadingCardProgress({ ...job.progress, examId: job.partial_exam_id }, jobCards[id]);
+        }
+      }
+      // Jobs that already finished are reported as soon as the socket connects
+      connectGroupWebSocket(groupId, jobCards);
+    } catch (e) {
+      console.warn("Could not restore job group status:", e);
+      localStorage.removeItem('groupId');
+    }
+  }
+
+  function connectGroupWebSocket(groupId, jobCards) {
+    const pending = new Set(Object.keys(jobCards));
+    const groupWs = new WebSocket(`ws://${window.location.host}/ws/group/${groupId}`); //PRODUCTION-FLAG
+
+    function finished(id) {
+      pending.delete(id);
+      if (pending.size === 0 && groupWs.readyState === WebSocket.OPEN) {
+        localStorage.removeItem('groupId');
+        groupWs.send("ack");
+        groupWs.close();
+      }
+    }
+
+    groupWs.onmessage = async (event) => {
+      // {"job_id", "type": "progress" | "done" | "error", ...}
+      const message = JSON.parse(event.data);
+      const cardId = jobCards[message.job_id];
+      if (!pending.has(message.job_id)) return;
+      if (message.type === "progress") {
+        updateLoadingCardProgress(message, cardId);
+      } else if (message.type === "done") {
+        for (let i = 0; i < 10; i++) {
+          try {
+            const response = await fetch(`/job-status/${message.job_id}`);
+            const data = await response.json();
+            if (data.status === "done" && data.result) {
+              updateLoadingCardToSuccess(data.result.examId, data.result.examName, cardId);
+              break;
+            }
+          } catch (e) {
+            // Retried below
+          }
+          await new Promise(res => setTimeout(res, 500));
+        }
+        finished(message.job_id);
+      } else if (message.type === "error") {
+        removeLoadingCard(cardId);
+        showFlashMessage('Cannot upload one of the exams', true);
+        finished(message.job_id);
+      }
+    };
+
+    groupWs.onerror = (err) => {
+      console.error("WebSocket error", err);
+    };
+  }
+
+  async function uploadBatch(files) {
+    const cards = files.map(file => createLoadingExamCard(file.name));
+    const formData = new FormData();
+    files.forEach(file => formData.append('files', file));
+
+    try {
+      const response = await fetch('/upload-pdfs', {
+        method: 'POST',
+        body: formData
+      });
+      const result = await response.json();
+      if (!response.ok) {
+        cards.forEach(cardId => removeLoadingCard(cardId));
+        showFlashMessage(result.detail || 'Upload failed', true);
+        return;
+      }
+
+      const jobCards = {};
+      result.files.forEach((file, i) => {
+        if (file.status === "done") {
+          updateLoadingCardToSuccess(file.examId, file.examName, cards[i]);
+        } else if (file.status === "processing") {
+          jobCards[file.job_id] = cards[i];
+        } else {
+          removeLoadingCard(cards[i]);
+          showFlashMessage(`${file.filename}: ${file.detail}`, true);
+        }
+      });
+      if (result.group_id) {
+        localStorage.setItem('groupId', result.group_id);
+        connectGroupWebSocket(result.group_id, jobCards);
+        showFlashMessage("Uploading Exams");
+      }
+    } catch (error) {
+      cards.forEach(cardId => removeLoadingCard(cardId));
+      showFlashMessage('Network error occurred', true);
+    }
+  }
+
   // ======= END ADDED SECTION =======
 
 
@@ -107,22 +227,24 @@ function connectWebSocket() {
     return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
   }
 
-  function handleFileSelect(file) {
-    if (!file) return;
+  function handleFileSelect(files) {
+    files = Array.from(files || []);
+    if (!files.length) return;
 
-    if (file.type !== 'application/pdf') {
+    if (files.some(file => file.type !== 'application/pdf')) {
       alert('Please select a PDF file only.');
       return;
     }
 
-    if (file.size > 10 * 1024 * 1024) {
+    if (files.some(file => file.size > 10 * 1024 * 1024)) {
       alert('File size must be less than 10MB.');
       return;
     }
 
-    selectedFile = file;
-    fileName.textContent = file.name;
-    fileSize.textContent = formatFileSize(file.size);
+    selectedFile = files[0];
+    selectedFiles = files;
+    fileName.textContent = files.length > 1 ? `${files.length} files` : files[0].name;
+    fileSize.textContent = formatFileSize(files.reduce((total, file) => total + file.size, 0));
 
     fileInfo.classList.remove('hidden');
     uploadBtn.disabled = false;
@@ -131,6 +253,7 @@ function connectWebSocket() {
 
   function resetForm() {
     selectedFile = null;
+    selectedFiles = [];
     fileInput.value = '';
     fileInfo.classList.add('hidden');
     uploadProgress.classList.add('hidden');
@@ -165,15 +288,15 @@ function connectWebSocket() {
   dropZone.addEventListener('drop', (e) => {
     e.preventDefault();
     dropZone.classList.remove('highlight');
-    const file = e.dataTransfer.files[0];
-    handleFileSelect(file);
+    const files = Array.from(e.dataTransfer.files);
+    handleFileSelect(files);
     const dataTransfer = new DataTransfer();
-    dataTransfer.items.add(file);
+    files.forEach(file => dataTransfer.items.add(file));
     fileInput.files = dataTransfer.files;
   });
 
   fileInput.addEventListener('change', (e) => {
-    handleFileSelect(e.target.files[0]);
+    handleFileSelect(e.target.files);
   });
 
   removeFileBtn.addEventListener('click', resetForm);
@@ -191,6 +314,17 @@ function connectWebSocket() {
       return;
     }
 
+    if (selectedFiles.length > 1) {
+      const files = selectedFiles;
+      uploadProgress.classList.remove('hidden');
+      setTimeout(() => {
+        uploadProgress.classList.add('hidden');
+        cancelBtn.click();
+      }, 1500);
+      await uploadBatch(files);
+      return;
+    }
+
     createLoadingExamCard(file.name);
 
     uploadProgress.classList.remove('hidden');
@@ -245,11 +379,12 @@ function connectWebSocket() {
 
   // Call restore on page load to resume any in-progress jobs
   restoreJobStatus();
+  restoreGroupStatus();
 
 
-  // Your existing card functions (unchanged)
+  // Card functions act on the single upload's card unless given the card of a batch file
   function createLoadingExamCard(filename) {
-    const loadingCardId = 'loading-' + Date.now();
+    const loadingCardId = `loading-${Date.now()}-${loadingCardCount++}`;
     currentLoadingCardId = loadingCardId;
 
     const loadingCard = document.createElement('div');
@@ -269,7 +404,8 @@ function connectWebSocket() {
       </div>
       <p class="text-sm text-gray-500 dark:text-gray-400 mb-4">${filename}</p>
       <div class="mt-4 flex items-center justify-between">
-        <span class="text-sm text-gray-400 dark:text-gray-500">Processing with AI...</span>
+        <span class="progress-text text-sm text-gray-400 dark:text-gray-500">Processing with AI...</span>
+        <a class="partial-link hidden text-blue-600 dark:text-green-400 hover:underline text-sm">View so far</a>
         <div class="text-xs bg-blue-100 dark:bg-green-900/30 text-blue-800 dark:text-green-300 px-3 py-1 rounded">
           In Progress
         </div>
@@ -282,10 +418,27 @@ function connectWebSocket() {
     return loadingCardId;
   }
 
-  function  updateLoadingCardToSuccess(examId, examName) {
-    if (!currentLoadingCardId) return;
+  function updateLoadingCardProgress(progress, cardId = currentLoadingCardId) {
+    if (!cardId) return;
+    const loadingCard = document.getElementById(cardId);
+    if (!loadingCard) return;
+
+    const progressText = loadingCard.querySelector('.progress-text');
+    if (progressText && progress.questions) {
+      progressText.textContent = `${progress.questions} of ~${Math.max(progress.expected || 0, progress.questions)} questions extracted...`;
+    }
+    // The questions so far are saved as a partial exam that can already be opened
+    const partialLink = loadingCard.querySelector('.partial-link');
+    if (partialLink && progress.examId) {
+      partialLink.href = `${URL}/exam/${progress.examId}`;
+      partialLink.classList.remove('hidden');
+    }
+  }
+
+  function  updateLoadingCardToSuccess(examId, examName, cardId = currentLoadingCardId) {
+    if (!cardId) return;
 
-    const loadingCard = document.getElementById(currentLoadingCardId);
+    const loadingCard = document.getElementById(cardId);
     if (loadingCard) {
       loadingCard.id = `exam-card-${examId}`;
       loadingCard.className = 'bg-white dark:bg-gray-800 p-5 rounded-xl shadow hover:shadow-lg transition flex flex-col justify-between min-h-[220px]';
@@ -310,16 +463,16 @@ function connectWebSocket() {
         </div>
       `;
     }
-    currentLoadingCardId = null;
+    if (cardId === currentLoadingCardId) currentLoadingCardId = null;
   }
 
-  function removeLoadingCard() {
-    if (currentLoadingCardId) {
-      const loadingCard = document.getElementById(currentLoadingCardId);
+  function removeLoadingCard(cardId = currentLoadingCardId) {
+    if (cardId) {
+      const loadingCard = document.getElementById(cardId);
       if (loadingCard) {
         loadingCard.remove();
       }
-      currentLoadingCardId = null;
+      if (cardId === currentLoadingCardId) currentLoadingCardId = null;
     }
   }
 
@@ -1,17 +1,98 @@
-
-import jwt
 from jose import jwt, JWTError
 from fastapi import APIRouter, Depends, HTTPException, status, Cookie
+import asyncio
 import os
+import re
+import time
+
+from .cache import TTLCache
+from .http_client import get_http_client
+from . import metrics
 
 JWT_SECRET = os.environ.get("JWT_SECRET")
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "4096"))  # Verified session tokens kept in memory
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", "300"))  # Seconds, never past the token's exp
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+GOOGLE_CERTS_DEFAULT_TTL = 3600  # Seconds, when the response has no max-age
+GOOGLE_CERTS_MIN_REFRESH = 60  # Seconds between refreshes forced by an unknown key id
+
+# access_token -> verified payload
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+metrics.watch_cache("session_tokens", token_cache)
 
 
 def get_current_user(access_token: str = Cookie(None)):
     if not access_token:
         return None  # Not logged in
+    payload = token_cache.get(access_token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(access_token, JWT_SECRET, algorithms=["HS256"])
-        return payload
     except JWTError:
-        return None
\ No newline at end of file
+        return None
+    ttl = TOKEN_CACHE_TTL
+    if "exp" in payload:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(access_token, payload, ttl=ttl)
+    return payload
+
+
+class GoogleCerts:
+    """
+    Google's ID token signing certificates, fetched with the shared HTTP client
+    and kept for the max-age Google sends. Concurrent logins share one fetch.
+    """
+
+    def __init__(self, url: str = GOOGLE_CERTS_URL):
+        self.url = url
+        self.certs = None
+        self.fetched_at = 0.0
+        self.expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, refresh: bool = False) -> dict:
+        """Return {key id: PEM certificate}, fetching when expired (or when `refresh` is set)."""
+        if self.certs is not None and not refresh and time.time() < self.expires_at:
+            return self.certs
+        async with self._lock:
+            now = time.time()
+            fresh = self.certs is not None and now < self.expires_at
+            if fresh and (not refresh or now - self.fetched_at < GOOGLE_CERTS_MIN_REFRESH):
+                return self.certs  # Fetched by another caller meanwhile
+            response = await get_http_client().get(self.url)
+            response.raise_for_status()
+            match = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+            self.certs = response.json()
+            self.fetched_at = now
+            self.expires_at = now + (int(match.group(1)) if match else GOOGLE_CERTS_DEFAULT_TTL)
+            return self.certs
+
+
+google_certs = GoogleCerts()
+
+
+async def verify_google_id_token(token: str, audience: str, clock_skew_in_seconds: int = 0) -> dict:
+    """
+    Verify a Google ID token against the cached certificates.
+    Google rotates its keys, so a token signed with an unknown key id triggers one refresh.
+    Raises:
+        ValueError: If the token is invalid, expired, for another audience or not issued by Google.
+    """
+    from google.auth import jwt as google_jwt  # Only needed at login
+    certs = await google_certs.get()
+    try:
+        idinfo = google_jwt.decode(token, certs=certs, audience=audience,
+                                   clock_skew_in_seconds=clock_skew_in_seconds)
+    except ValueError as e:
+        if "Certificate for key id" not in str(e):
+            raise
+        certs = await google_certs.get(refresh=True)
+        idinfo = google_jwt.decode(token, certs=certs, audience=audience,
+                                   clock_skew_in_seconds=clock_skew_in_seconds)
+    if idinfo.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer: {idinfo.get('iss')}")
+    return idinfo
@@ -0,0 +1,21 @@
+import hashlib
+
+
+def make_etag(*parts) -> str:
+    """Return a strong ETag built from everything the response body depends on."""
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header against the current ETag.
+    Handles lists of tags, weak validators (W/"...") and "*".
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
@@ -0,0 +1,25 @@
+import httpx
+import os
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))  # Pooled outbound connections (Google OAuth/certs)
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "10"))  # Seconds
+
+_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the app-wide pooled HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
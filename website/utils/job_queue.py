@@ -0,0 +1,421 @@
+"""
+Bounded worker-pool queue for exam extraction jobs.
+
+A fixed number of workers pull jobs from a bounded asyncio queue, retry
+transient Gemini/Firebase errors with exponential backoff, and jobs left
+in `processing` by a previous process are re-queued at startup.
+Uploads of a file that is already being extracted, by this or any other
+process, attach to the running job (single-flight) instead of starting
+another Gemini call: inflight/{file_hash} holds the leading job, its lease
+and the attached jobs, which the leader finishes.
+A periodic sweep deletes job records that no client picked up.
+Each process holds a lease on its jobs (claimed_by) and renews it while they
+are queued or running; jobs whose lease expired are taken over by any process
+on the host that has their spooled upload.
+"""
+import asyncio
+import httpx
+import logging
+import os
+import random
+import sys
+import time
+
+from .jobs import UploadExamJobs, JobCancelled, INSTANCE_ID, get_jobs_ref, get_job_groups_ref, get_inflight_ref
+from . import metrics
+from ..firebase.Exam import UploadExamToDB
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))  # Concurrent extraction jobs per process
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "20"))  # Waiting jobs before uploads get 429
+JOB_MAX_RETRIES = int(os.environ.get("JOB_MAX_RETRIES", "3"))
+JOB_RETRY_BASE_DELAY = float(os.environ.get("JOB_RETRY_BASE_DELAY", "2"))  # Seconds, doubled per retry
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "3600"))  # Seconds done/error jobs wait for the client's ack
+JOB_STALE_TTL = float(os.environ.get("JOB_STALE_TTL", "21600"))  # Seconds without progress before a processing job is dropped
+JOB_SWEEP_INTERVAL = float(os.environ.get("JOB_SWEEP_INTERVAL", "600"))  # Seconds between sweeps
+JOB_CLAIM_LEASE = float(os.environ.get("JOB_CLAIM_LEASE", "60"))  # Seconds without renewal before another process takes a job over
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_FIREBASE_ERRORS = (  # Names in firebase_admin.exceptions
+    "UnavailableError",
+    "DeadlineExceededError",
+    "InternalError",
+    "ResourceExhaustedError",
+)
+
+
+JOBS_FINISHED = metrics.counter("jobs_finished_total", "Extraction jobs by final outcome", ["outcome"])
+JOB_RETRIES = metrics.counter("job_retries_total", "Extraction attempts retried after a transient error")
+
+
+class QueueFull(Exception):
+    """Raised when the job queue cannot accept more work."""
+
+
+def job_updated_at(data: dict) -> float:
+    """Last time a job record changed (records written before updated_at fall back to the claim time)."""
+    return max(data.get("updated_at") or 0, (data.get("claimed_by") or {}).get("at") or 0)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Return True for transient errors worth another attempt."""
+    # Both SDKs are imported lazily; if one is not loaded yet, the error cannot come from it
+    genai_errors = sys.modules.get("google.genai.errors")
+    if genai_errors and isinstance(error, genai_errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    firebase_exceptions = sys.modules.get("firebase_admin.exceptions")
+    if firebase_exceptions and isinstance(error, tuple(
+            getattr(firebase_exceptions, name) for name in RETRYABLE_FIREBASE_ERRORS)):
+        return True
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError, asyncio.TimeoutError))
+
+
+def join_inflight(record: dict, job_id: str, user: dict, lead: bool) -> dict:
+    """
+    Transaction on inflight/{file_hash}: attach the job to a live extraction of the file, or
+    (if `lead`) make it the extraction, taking over the jobs of a leader whose lease expired.
+    """
+    now = time.time()
+    member = {"user_id": user["sub"], "user_email": user.get("email")}
+    if record and record.get("job_id") != job_id and \
+            now - (record.get("claimed_by") or {}).get("at", 0) <= JOB_CLAIM_LEASE:
+        return {**record, "followers": {**(record.get("followers") or {}), job_id: member}}
+    if not lead:
+        return record
+    followers = dict((record or {}).get("followers") or {})
+    if record and record.get("job_id") not in (None, job_id):  # Its process stopped; finish it with the others
+        followers[record["job_id"]] = {"user_id": record.get("user_id"), "user_email": record.get("user_email")}
+    followers.pop(job_id, None)
+    return {"job_id": job_id, **member, "claimed_by": {"instance": INSTANCE_ID, "at": now}, "followers": followers}
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS, maxsize: int = JOB_QUEUE_SIZE):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.queue = None
+        self.tasks = []
+        self.held = set()  # Ids of the jobs queued or running here, whose claim is renewed
+        self.inflight = {}  # file_hash -> job_id of the extractions led here (inflight/{file_hash})
+        self.sweeper = None
+        self.collected = {"done": 0, "error": 0, "stale": 0, "group": 0, "inflight": 0}  # Records deleted by sweep()
+
+    async def start(self):
+        """Start the workers and re-queue jobs interrupted by a restart."""
+        self.queue = asyncio.Queue(self.maxsize)
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self.keep_claims()))
+        self.sweeper = asyncio.create_task(self.sweep_periodically())
+        await self.recover()
+
+    async def stop(self):
+        tasks = self.tasks + ([self.sweeper] if self.sweeper else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+        self.sweeper = None
+
+    def free_slots(self) -> int:
+        """How many more jobs submit() accepts right now."""
+        if self.queue is None:
+            return 0
+        return self.queue.maxsize - self.queue.qsize() if self.queue.maxsize > 0 else sys.maxsize
+
+    async def submit(self, job_id: str, user: dict, file_hash: str):
+        """
+        Queue a spooled upload for extraction, unless the same file is already queued or being
+        extracted by any process: then the job is attached to that extraction (inflight/{file_hash})
+        and receives the same result (and notification) when it finishes.
+        Returns:
+            int | None: Position of the job in the queue (1 = next to run), None if it was attached.
+        Raises:
+            QueueFull: If the queue is at capacity and no extraction of the file is in flight.
+        """
+        lead = not self.queue.full()
+        record = await get_inflight_ref().child(file_hash).transaction(
+            lambda record: join_inflight(record, job_id, user, lead))
+        if record and record.get("job_id") != job_id and job_id in (record.get("followers") or {}):
+            return None
+        if not record or record.get("job_id") != job_id:
+            raise QueueFull("Too many exams are being processed right now")
+        try:
+            self.queue.put_nowait((job_id, user, file_hash))
+        except asyncio.QueueFull:  # Filled by another upload during the transaction
+            error = QueueFull("Too many exams are being processed right now")
+            await self.fail_followers(await self.take_followers(file_hash, job_id), error)
+            raise error
+        self.held.add(job_id)
+        self.inflight[file_hash] = job_id
+        return self.queue.qsize()
+
+    async def take_followers(self, file_hash: str, job_id: str) -> list:
+        """
+        End the extraction of a file led by `job_id`: delete inflight/{file_hash}.
+        Returns:
+            list: The attached jobs, as [(job_id, user)].
+        """
+        if self.inflight.get(file_hash) == job_id:
+            del self.inflight[file_hash]
+        taken = {}
+
+        def take(record):
+            taken.clear()
+            if not record or record.get("job_id") != job_id:
+                return record  # Taken over by another process after our lease expired
+            taken.update(record.get("followers") or {})
+            return None
+
+        await get_inflight_ref().child(file_hash).transaction(take)
+        return [(follower_id, {"sub": follower["user_id"], "email": follower.get("user_email")})
+                for follower_id, follower in taken.items()]
+
+    async def renew_inflight(self, file_hash: str, job_id: str) -> bool:
+        """Renew the lease on an extraction led here. Returns False if another process took it over."""
+        def renew(record):
+            if not record or record.get("job_id") != job_id:
+                return record
+            return {**record, "claimed_by": {"instance": INSTANCE_ID, "at": time.time()}}
+
+        record = await get_inflight_ref().child(file_hash).transaction(renew)
+        return bool(record) and record.get("job_id") == job_id
+
+    async def worker(self):
+        while True:
+            job_id, user, file_hash = await self.queue.get()
+            try:
+                await self.run(job_id, user, file_hash)
+            except Exception:
+                logger.exception("Job %s could not be finalized", job_id)
+            finally:
+                self.held.discard(job_id)
+                if self.inflight.get(file_hash) == job_id:
+                    del self.inflight[file_hash]
+                self.queue.task_done()
+
+    async def run(self, job_id: str, user: dict, file_hash: str):
+        """Process one job, retrying transient errors with exponential backoff and jitter."""
+        job = UploadExamJobs(job_id)
+        attempt = 0
+        while True:
+            try:
+                result = await job.process_and_notify(user, file_hash)
+                JOBS_FINISHED.inc(outcome="done")
+                await self.finish_followers(await self.take_followers(file_hash, job_id), file_hash, user, result)
+                return
+            except JobCancelled as e:
+                JOBS_FINISHED.inc(outcome="cancelled")
+                await job.cancel(user)
+                await self.hand_over(await self.take_followers(file_hash, job_id), file_hash, e.exam)
+                return
+            except Exception as e:
+                if attempt >= JOB_MAX_RETRIES or not is_retryable(e):
+                    JOBS_FINISHED.inc(outcome="error")
+                    await job.fail(user, e)
+                    await self.fail_followers(await self.take_followers(file_hash, job_id), e)
+                    return
+                JOB_RETRIES.inc()
+                delay = JOB_RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.8, 1.2)
+                logger.warning("Job %s failed (%s), retrying in %.1fs", job_id, e, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def finish_followers(self, followers: list, file_hash: str, leader: dict, result: dict):
+        """Give every attached user their own reference to the freshly extracted exam."""
+        results = {leader["sub"]: result}  # One exam per user, even if they uploaded the file twice
+        for job_id, user in followers:
+            follower = UploadExamJobs(job_id)
+            try:
+                if user["sub"] not in results:
+                    # A near-duplicate upload reused the exam of another file (duplicateOf)
+                    linked = await UploadExamToDB(user).link_existing_exam(result.get("duplicateOf") or file_hash)
+                    results[user["sub"]] = linked or result
+                await follower.finish(user, results[user["sub"]])
+            except Exception as e:
+                logger.exception("Attached job %s could not be finished", job_id)
+                await follower.fail(user, e)
+
+    async def hand_over(self, followers: list, file_hash: str, exam: dict):
+        """Save the extraction of a cancelled job for the first attached job, and finish the others with it."""
+        if not followers:
+            return
+        (job_id, user), followers = followers[0], followers[1:]
+        job = UploadExamJobs(job_id)
+        try:
+            exam_id = await UploadExamToDB(user).save_to_firebase(**exam)
+            result = {"examId": exam_id, "examName": exam["exam_name"]}
+            await job.finish(user, result)
+        except Exception as e:
+            logger.exception("Attached job %s could not take over a cancelled extraction", job_id)
+            await job.fail(user, e)
+            await self.fail_followers(followers, e)
+            return
+        await self.finish_followers(followers, file_hash, user, result)
+
+    async def fail_followers(self, followers: list, error: Exception):
+        for job_id, user in followers:
+            await UploadExamJobs(job_id).fail(user, error)
+
+    async def recover(self) -> int:
+        """
+        Re-queue `processing` jobs whose spooled upload is on this machine and whose
+        claim lease expired. Jobs without a spooled upload are attached to another
+        upload of the same file, and are finished by whichever process leads it.
+        Returns:
+            int: Number of recovered jobs.
+        """
+        try:
+            jobs = await get_jobs_ref().equal_to("status", "processing") or {}
+        except Exception:
+            logger.exception("Could not load interrupted jobs")
+            return 0
+        candidates = [(job_id, data) for job_id, data in jobs.items()
+                      if data.get("file_hash") and job_id not in self.held]
+        spooled = await asyncio.to_thread(lambda: [UploadExamJobs(job_id).has_upload() for job_id, _ in candidates])
+        recovered = 0
+        for (job_id, data), has_upload in zip(candidates, spooled):
+            job = UploadExamJobs(job_id)
+            if not has_upload or not await job.claim(JOB_CLAIM_LEASE):
+                continue
+            user = {"sub": data["user_id"], "email": data.get("user_email")}
+            try:
+                if await self.submit(job_id, user, data["file_hash"]) is None:
+                    await job.discard_upload()  # Another process extracts the file meanwhile
+                recovered += 1
+            except QueueFull:
+                await job.fail(user, QueueFull("Job could not be resumed after a restart"))
+        if recovered:
+            logger.info("Recovered %d interrupted jobs", recovered)
+        return recovered
+
+    async def sweep(self, now: float = None) -> int:
+        """
+        Delete job records nobody will pick up: done/error jobs older than JOB_RESULT_TTL
+        (the client never acked) and processing jobs without progress for JOB_STALE_TTL.
+        Returns:
+            int: Number of deleted jobs.
+        """
+        now = now or time.time()
+        collected = 0
+        for status, ttl in (("done", JOB_RESULT_TTL), ("error", JOB_RESULT_TTL), ("processing", JOB_STALE_TTL)):
+            try:
+                jobs = await get_jobs_ref().equal_to("status", status) or {}
+            except Exception:
+                logger.exception("Could not load %s jobs to sweep", status)
+                continue
+            for job_id, data in jobs.items():
+                if now - job_updated_at(data) < ttl:
+                    continue
+                if status == "processing" and data.get("file_hash") in self.inflight:
+                    continue  # Still queued or running here
+                job = UploadExamJobs(job_id)
+                try:
+                    if status == "processing":
+                        await job.delete_partial_exam(data.get("user_id"), data.get("partial_exam_id"))
+                    await job.delete_job()
+                    await job.discard_upload()
+                except Exception:
+                    logger.exception("Could not delete job %s", job_id)
+                    continue
+                self.collected["stale" if status == "processing" else status] += 1
+                collected += 1
+        collected += await self.sweep_groups(now)
+        collected += await self.sweep_inflight(now)
+        return collected
+
+    async def sweep_groups(self, now: float) -> int:
+        """Delete batch-upload groups never acknowledged (their jobs are swept above)."""
+        try:
+            groups = await get_job_groups_ref().equal_to("status", "open") or {}
+        except Exception:
+            logger.exception("Could not load job groups to sweep")
+            return 0
+        collected = 0
+        for group_id, data in groups.items():
+            if now - (data.get("created_at") or 0) < JOB_STALE_TTL:
+                continue
+            try:
+                await get_job_groups_ref().child(group_id).delete()
+            except Exception:
+                logger.exception("Could not delete job group %s", group_id)
+                continue
+            self.collected["group"] += 1
+            collected += 1
+        return collected
+
+    async def sweep_inflight(self, now: float) -> int:
+        """Delete inflight records whose leader stopped renewing them (their jobs are swept above)."""
+        try:
+            records = await get_inflight_ref().get() or {}
+        except Exception:
+            logger.exception("Could not load in-flight extractions to sweep")
+            return 0
+
+        def stale(record):
+            if record and now - (record.get("claimed_by") or {}).get("at", 0) < JOB_STALE_TTL:
+                return record  # Renewed meanwhile
+            return None
+
+        collected = 0
+        for file_hash, record in records.items():
+            if now - (record.get("claimed_by") or {}).get("at", 0) < JOB_STALE_TTL:
+                continue
+            try:
+                await get_inflight_ref().child(file_hash).transaction(stale)
+            except Exception:
+                logger.exception("Could not delete the in-flight extraction of %s", file_hash)
+                continue
+            self.collected["inflight"] += 1
+            collected += 1
+        return collected
+
+    async def keep_claims(self):
+        """
+        Renew the lease on every job and extraction held here, and take over jobs
+        whose lease expired elsewhere.
+        """
+        while True:
+            await asyncio.sleep(JOB_CLAIM_LEASE / 3)
+            for job_id in list(self.held):
+                try:
+                    if not await UploadExamJobs(job_id).renew_claim():
+                        logger.warning("Lost the claim on job %s", job_id)
+                except Exception:
+                    logger.exception("Could not renew the claim on job %s", job_id)
+            for file_hash, job_id in list(self.inflight.items()):
+                try:
+                    if not await self.renew_inflight(file_hash, job_id):
+                        logger.warning("Lost the in-flight extraction of job %s", job_id)
+                except Exception:
+                    logger.exception("Could not renew the in-flight extraction of job %s", job_id)
+            try:
+                await self.recover()
+            except Exception:
+                logger.exception("Could not recover jobs with expired claims")
+
+    async def sweep_periodically(self):
+        while True:
+            await asyncio.sleep(JOB_SWEEP_INTERVAL)
+            try:
+                collected = await self.sweep()
+            except Exception:
+                logger.exception("Job sweep failed")
+                continue
+            if collected:
+                logger.info("Swept %d expired jobs (totals: %s)", collected, self.collected)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "inflight_files": len(self.inflight),
+            "collected": dict(self.collected)
+        }
+
+
+job_queue = JobQueue()
+
+metrics.gauge("job_queue_depth", "Jobs waiting for a worker", lambda: job_queue.stats()["queued"])
+metrics.gauge("job_inflight_files", "Distinct files queued or being extracted by this process", lambda: job_queue.stats()["inflight_files"])
+metrics.gauge("jobs_collected_total", "Job records deleted by the sweeper",
+              lambda: {(reason,): count for reason, count in job_queue.collected.items()}, ["reason"], "counter")
@@ -1,61 +1,342 @@
-from .. import connections
-from ..firebase import db
-from ..firebase.Exam import UploadExamToDB
-from ..gimini.runner import Gimini_Proccess
+from .cache import TTLCache
+from .notify import bus
+from .metrics import histogram, span, watch_cache
+from ..firebase.storage import reference
+from ..firebase.Exam import UploadExamToDB, GetExamFromDB
+from ..gimini.runner import Gimini_Proccess, prepare_pdf
 import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+JOB_SPOOL_DIR = os.environ.get("JOB_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "exam-shuffler-jobs")
+INSTANCE_ID = uuid.uuid4().hex  # Identifies this process when claiming jobs
+JOB_STATUS_CACHE_SIZE = int(os.environ.get("JOB_STATUS_CACHE_SIZE", "2048"))
+JOB_STATUS_CACHE_TTL = float(os.environ.get("JOB_STATUS_CACHE_TTL", "300"))  # Seconds
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", "1"))  # Minimum seconds between progress messages
+JOB_PARTIAL_SAVE_INTERVAL = float(os.environ.get("JOB_PARTIAL_SAVE_INTERVAL", "5"))  # Minimum seconds between partial exam saves, 0 disables them
+
+logger = logging.getLogger(__name__)
+
+FIRST_QUESTION_SECONDS = histogram("job_first_question_seconds",
+                                   "Time from the start of an extraction to its first streamed question")
+
+# job_id -> job record, written through by this process and dropped when another process notifies
+job_status_cache = TTLCache(JOB_STATUS_CACHE_SIZE, JOB_STATUS_CACHE_TTL)
+watch_cache("job_status", job_status_cache)
+bus.on_remote_message(lambda job_id, message: job_status_cache.pop(job_id))
+
+
+class JobCancelled(Exception):
+    """Raised when the user deleted the partial exam of a running job; the extraction is not saved for them."""
+
+    def __init__(self, exam: dict):
+        super().__init__("The exam was deleted during extraction")
+        self.exam = exam  # save_to_firebase arguments, so jobs attached to this one still get the exam
+
+
+def get_jobs_ref():
+    """Return the jobs reference."""
+    return reference("jobs")
+
+
+def get_inflight_ref():
+    """Return the file_hash -> extraction in flight reference (single-flight across processes)."""
+    return reference("inflight")
+
+
+def get_job_groups_ref():
+    """Return the job groups reference (the jobs of one batch upload)."""
+    return reference("job_groups")
+
+
+class JobProgress:
+    """
+    Receives a job's extraction progress (gimini.runner.ExtractionProgress) while Gemini streams:
+    publishes {"type": "progress", "questions", "expected", "examId"} messages, and saves the
+    questions so far as a partial exam, the first time as soon as the first question arrives.
+    """
+
+    def __init__(self, job, uploader: UploadExamToDB, file_hash: str, exam_id: str = None, filename: str = None):
+        self.job = job
+        self.uploader = uploader
+        self.file_hash = file_hash
+        self.exam_id = exam_id  # Partial exam saved by this or an earlier attempt
+        self.filename = filename
+        self.published_at = 0.0
+        self.saved_at = 0.0
+        self.saved_count = 0
+        self.lock = asyncio.Lock()
+        self.started = time.monotonic()
+        self.first_question = True
+        self.deleted = False  # The user deleted the partial exam, which cancels the job
+
+    async def __call__(self, progress):
+        now = time.monotonic()
+        if self.first_question:
+            self.first_question = False
+            FIRST_QUESTION_SECONDS.observe(now - self.started)
+        if JOB_PARTIAL_SAVE_INTERVAL > 0 and now - self.saved_at >= JOB_PARTIAL_SAVE_INTERVAL \
+                and not self.deleted and not self.lock.locked():  # Chunks stream concurrently; one save at a time is enough
+            async with self.lock:
+                try:
+                    if await self.save(progress):
+                        self.saved_at = time.monotonic()
+                except Exception:
+                    # Best effort: a failed partial save must not abort (and re-bill) the Gemini stream
+                    logger.exception("Could not save the partial exam of job %s", self.job.job_id)
+                    self.saved_at = time.monotonic()
+        if now - self.published_at >= JOB_PROGRESS_INTERVAL:
+            self.published_at = now
+            await self.job.notify(json.dumps({
+                "type": "progress",
+                "questions": progress.found,
+                "expected": progress.expected,
+                "examId": None if self.deleted else self.exam_id
+            }))
+
+    async def save(self, progress) -> bool:
+        """Save the questions so far if there are more than last time."""
+        exam = await progress.snapshot_exam()
+        if len(exam["questions"]) <= self.saved_count:
+            return False
+        exam_name = (exam.get("test_data") or {}).get("test_description") or self.filename or "Unknown Exam"
+        with span("job", "save_partial"):
+            exam_id = await self.uploader.save_partial_exam(self.file_hash, exam, exam_name, self.exam_id)
+            if exam_id is None:
+                # Keep exam_id: completing it fails the same way, also after a retry or a restart
+                logger.info("Partial exam %s of job %s was deleted, the job is cancelled",
+                            self.exam_id, self.job.job_id)
+                self.deleted = True
+                return False
+            self.exam_id = exam_id
+            await self.job.record_progress(self.exam_id, len(exam["questions"]), progress.expected)
+        self.saved_count = len(exam["questions"])
+        return True
+
+
 class UploadExamJobs:
     def __init__(self,job_id:str):
         self.job_id = job_id
-        self.ref = db.reference(f'jobs/{self.job_id}')
+        self.ref = reference(f'jobs/{self.job_id}')
+        self.spool_path = os.path.join(JOB_SPOOL_DIR, f"{self.job_id}.pdf")
 
 
     async def set_job_status(self, status: str, user_id: str, result: dict = None):
         data = {
             "status": status,
-            "user_id": user_id
+            "user_id": user_id,
+            "updated_at": time.time()
         }
         if result == "error":
             data["error"] = "An error occurred during processing"
         if result is not None:
             data["result"] = result
-        await asyncio.to_thread(lambda: self.ref.set(data))
+        await self.ref.set(data)
+        job_status_cache.set(self.job_id, data)
 
     async def get_job_status(self):
-        return await asyncio.to_thread(lambda: self.ref.get())
+        """Return the job record, from the write-through cache when possible."""
+        data = job_status_cache.get(self.job_id)
+        if data is None:
+            data = await self.ref.get()
+            if data:
+                job_status_cache.set(self.job_id, data)
+        return data
 
+    async def record_progress(self, exam_id: str, questions: int, expected: int):
+        """Keep the partial exam on the job record, so a retry or a restart continues it and a failure removes it."""
+        data = {
+            "partial_exam_id": exam_id,
+            "progress": {"questions": questions, "expected": expected},
+            "updated_at": time.time()
+        }
+        await self.ref.update(data)
+        cached = job_status_cache.get(self.job_id)
+        if cached is not None:
+            job_status_cache.set(self.job_id, {**cached, **data})
+
+    async def delete_job(self):
+        job_status_cache.pop(self.job_id)
+        await self.ref.delete()
+
+    async def create_job(self, user: dict, file_hash: str, filename: str, group_id: str = None):
+        """Store a processing job with everything needed to resume it after a restart."""
+        now = time.time()
+        data = {
+            "status": "processing",
+            "user_id": user["sub"],
+            "user_email": user.get("email"),
+            "file_hash": file_hash,
+            "filename": filename,
+            "group_id": group_id,
+            "claimed_by": {"instance": INSTANCE_ID, "at": now},
+            "updated_at": now
+        }
+        await self.ref.set(data)
+        job_status_cache.set(self.job_id, data)
 
-    async def process_and_notify(self,job_id, user, file_content, file_size, file_hash, filename):
+    async def claim(self, lease: float) -> bool:
+        """
+        Take over a processing job whose claim was not renewed for `lease` seconds
+        (the process holding it stopped). Returns False if a live process holds it.
+        """
+        def take(claimed_by):
+            if claimed_by and claimed_by.get("instance") != INSTANCE_ID and \
+                    time.time() - claimed_by.get("at", 0) <= lease:
+                return claimed_by  # Held by a process that still renews it
+            return {"instance": INSTANCE_ID, "at": time.time()}
+
+        claimed_by = await self.ref.child("claimed_by").transaction(take)
+        return claimed_by["instance"] == INSTANCE_ID
+
+    async def renew_claim(self) -> bool:
+        """Renew this process's lease on the job. Returns False if it was lost (or the job is gone)."""
+        def renew(claimed_by):
+            if not claimed_by or claimed_by.get("instance") != INSTANCE_ID:
+                return claimed_by
+            return {"instance": INSTANCE_ID, "at": time.time()}
+
+        claimed_by = await self.ref.child("claimed_by").transaction(renew)
+        return bool(claimed_by) and claimed_by.get("instance") == INSTANCE_ID
+
+    # --- Spooled upload (streamed to disk by /upload-pdf so queued jobs hold no file bytes in memory) ---
+    async def load_upload(self) -> bytes:
+        def read():
+            with open(self.spool_path, "rb") as f:
+                return f.read()
+        return await asyncio.to_thread(read)
+
+    def has_upload(self) -> bool:
+        return os.path.exists(self.spool_path)
+
+    async def discard_upload(self):
+        try:
+            await asyncio.to_thread(os.remove, self.spool_path)
+        except FileNotFoundError:
+            pass
+
+    async def notify(self, message: str):
+        """Publish a message for the job; the process holding its WebSocket (if any) delivers it."""
+        await bus.publish(self.job_id, message)
+
+
+    async def process_and_notify(self, user, file_hash) -> dict:
+        """
+        Extract the spooled exam, save it and notify the frontend.
+        Raises on failure so the queue can retry.
+        Returns:
+            dict: {"examId", "examName"} of the saved exam.
+        Raises:
+            JobCancelled: If the user deleted the partial exam during extraction.
+        """
         uploader = UploadExamToDB(user)
+        with span("job", "load_upload"):
+            file_content = await self.load_upload()
+            record = await self.get_job_status() or {}
+        with span("job", "prepare"):
+            document = await prepare_pdf(file_content)
+        fingerprint = document.get("fingerprint")
+        if fingerprint and not record.get("partial_exam_id"):
+            # A re-saved or watermarked copy of an extracted exam reuses it instead of calling Gemini
+            with span("job", "near_duplicate"):
+                result = await uploader.reuse_similar_exam(file_hash, fingerprint)
+            if result:
+                await self.finish(user, result)
+                await self.discard_upload()
+                return result
+
+        progress = JobProgress(self, uploader, file_hash, record.get("partial_exam_id"), record.get("filename"))
         # Call Gemini processing
+        with span("job", "extract"):
+            gimini_data = await Gimini_Proccess(file_content, on_progress=progress,
+                                                document=document).call_gimini_progress()
+        if not gimini_data:
+            raise ValueError("Exam Error")
         try:
-            gimini_data = await Gimini_Proccess(file_content).call_gimini_progress()
-            if not gimini_data:
-                raise ValueError("Exam Error")
-            try:
-                exam_name = gimini_data["test_data"]["test_description"]
-            except KeyError:
-                exam_name = "Unknown Exam"
-            # Save exam to firebase with real data
-            exam_id = await uploader.save_to_firebase(
-                file_hash=file_hash,
-                data=gimini_data,
-                exam_name=exam_name
-            )
-            result = {"examId": exam_id, "examName": exam_name}
-            
+            exam_name = gimini_data["test_data"]["test_description"]
+        except KeyError:
+            exam_name = "Unknown Exam"
+        exam = {"file_hash": file_hash, "data": gimini_data, "exam_name": exam_name, "fingerprint": fingerprint}
+        if progress.deleted:
+            raise JobCancelled(exam)
+        # Save exam to firebase with real data
+        with span("job", "save"):
+            exam_id = await uploader.save_to_firebase(exam_id=progress.exam_id, **exam)
+        if exam_id is None:  # Deleted after the last partial save
+            raise JobCancelled(exam)
+        result = {"examId": exam_id, "examName": exam_name}
+
+        with span("job", "finish"):
             # Update job status in DB
-            job = UploadExamJobs(job_id)
-            await job.set_job_status("done", user["sub"], result)
-        
+            await self.set_job_status("done", user["sub"], result)
+            await self.discard_upload()
+
             # Notify frontend if connected and delete the job
-            websocket = connections.get(job_id)
-            if websocket:
-                await websocket.send_text("done")
-        
-        except Exception as e:
-            job = UploadExamJobs(job_id)
-            # Handle any errors during processing
-            await job.set_job_status("error", user["sub"], {"error": str(e)})
-            websocket = connections.get(job_id)
-            if websocket:
-                await websocket.send_text("error")
\ No newline at end of file
+            await self.notify("done")
+        return result
+
+    async def finish(self, user, result: dict):
+        """Mark the job as done with an exam extracted by another job and notify the frontend."""
+        await self.set_job_status("done", user["sub"], result)
+        await self.notify("done")
+
+    async def delete_partial_exam(self, user_id: str, exam_id: str):
+        """Delete the partial exam of a job that will never complete it."""
+        if not exam_id:
+            return
+        try:
+            await GetExamFromDB({"sub": user_id}).delete_exam(exam_id)
+        except ValueError:
+            logger.exception("Could not delete the partial exam of job %s", self.job_id)
+
+    async def cancel(self, user):
+        """Mark the job as failed because the user deleted its partial exam, and notify the frontend."""
+        await self.set_job_status("error", user["sub"], {"error": "The exam was deleted during extraction",
+                                                         "cancelled": True})
+        await self.discard_upload()
+        await self.notify("error")
+
+    async def fail(self, user, error: Exception):
+        """Mark the job as failed after the last attempt, remove its partial exam and notify the frontend."""
+        record = await self.get_job_status() or {}
+        await self.delete_partial_exam(user["sub"], record.get("partial_exam_id"))
+        await self.set_job_status("error", user["sub"], {"error": str(error)})
+        await self.discard_upload()
+        await self.notify("error")
+
+
+class UploadJobGroup:
+    """The jobs of one batch upload (/upload-pdfs), followed together on /ws/group/{group_id}."""
+
+    def __init__(self, group_id: str):
+        self.group_id = group_id
+        self.ref = get_job_groups_ref().child(group_id)
+
+    async def create(self, user_id: str, jobs: dict):
+        """
+        Args:
+            jobs (dict): {job_id: filename} of the group's queued jobs.
+        """
+        await self.ref.set({
+            "user_id": user_id,
+            "status": "open",  # Lets the sweeper find groups nobody acknowledged
+            "jobs": jobs,
+            "created_at": time.time()
+        })
+
+    async def get(self):
+        return await self.ref.get()
+
+    async def get_job_statuses(self, job_ids) -> dict:
+        """Return {job_id: job record or None} for the group's jobs."""
+        records = await asyncio.gather(*(UploadExamJobs(job_id).get_job_status() for job_id in job_ids))
+        return dict(zip(job_ids, records))
+
+    async def delete(self, job_ids=()):
+        """Delete the group and the given job records (once the client has everything)."""
+        await asyncio.gather(*(UploadExamJobs(job_id).delete_job() for job_id in job_ids))
+        await self.ref.delete()
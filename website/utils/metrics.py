@@ -0,0 +1,217 @@
+"""
+Process-local metrics, exposed in the Prometheus text format on /metrics.
+
+    REQUESTS = counter("app_requests_total", "Requests served", ["route"])
+    REQUESTS.inc(route="/dashboard")
+    with span("upload", "stream_to_spool"):
+        ...
+
+Counters and histograms are updated in place; cache and queue figures are read
+when /metrics is scraped (watch_cache, gauge). With several workers each process
+reports its own numbers, so scrape every worker or aggregate by instance.
+"""
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))  # Log requests slower than this, 0 disables
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(label, "")) for label in self.labels), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {state[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {state[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class Gauge:
+    """
+    A value read from a callback at scrape time. The callback returns a number, or {label values: number}.
+    metric_type="counter" exports totals that some other object keeps (e.g. cache hits).
+    """
+
+    def __init__(self, name: str, documentation: str, read, labels=(), metric_type: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.labels = tuple(labels)
+        self.metric_type = metric_type
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        try:
+            values = self.read()
+        except Exception:
+            logger.exception("Could not read gauge %s", self.name)
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+_metrics = {}
+_caches = {}  # name -> TTLCache
+
+
+def _register(metric):
+    return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name: str, documentation: str, labels=()) -> Counter:
+    return _register(Counter(name, documentation, labels))
+
+
+def histogram(name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, documentation, labels, buckets))
+
+
+def gauge(name: str, documentation: str, read, labels=(), metric_type: str = "gauge") -> Gauge:
+    return _register(Gauge(name, documentation, read, labels, metric_type))
+
+
+def watch_cache(name: str, cache):
+    """Export a TTLCache's size and hit/miss/eviction counters."""
+    _caches[name] = cache
+
+
+def _cache_stat(stat: str):
+    return lambda: {(name,): cache.stats()[stat] for name, cache in _caches.items()}
+
+
+gauge("cache_entries", "Entries in an in-process cache", _cache_stat("size"), ["cache"])
+gauge("cache_hits_total", "Cache hits", _cache_stat("hits"), ["cache"], "counter")
+gauge("cache_misses_total", "Cache misses", _cache_stat("misses"), ["cache"], "counter")
+gauge("cache_evictions_total", "Entries evicted for size", _cache_stat("evictions"), ["cache"], "counter")
+
+STAGE_SECONDS = histogram("pipeline_stage_seconds", "Time spent in each stage of the upload and job pipelines",
+                          ["pipeline", "stage", "outcome"])
+HTTP_REQUEST_SECONDS = histogram("http_request_duration_seconds", "HTTP request latency by route",
+                                 ["method", "route", "status"])
+
+
+@contextmanager
+def span(pipeline: str, stage: str):
+    """Time one stage of a pipeline; stages that raise are recorded with outcome="error"."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, pipeline=pipeline, stage=stage, outcome=outcome)
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """Record the latency of every HTTP request by route template, and log slow ones when SLOW_REQUEST_MS is set."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            # The template (/exam/{exam_id}), not the path, so ids do not explode the label set
+            route_path = getattr(route, "path", None) or ("static" if scope["path"].startswith("/static/") else "unmatched")
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route_path, status=status_code)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                logger.warning("Slow request: %s %s -> %d in %.0f ms",
+                               scope["method"], scope["path"], status_code, elapsed * 1000)
@@ -0,0 +1,195 @@
+"""
+Job notification bus.
+
+Jobs publish messages ("done", "error") for a job_id and the process holding
+that job's WebSocket delivers them, so the upload, the extraction worker and
+the socket no longer have to land in the same process.
+
+Backends (NOTIFY_BACKEND):
+    memory: delivers in-process; enough for a single uvicorn worker (default).
+    sqlite: messages go through a shared SQLite file that every worker on the
+        host polls, so any worker can publish to a socket held by another.
+"""
+from abc import ABC, abstractmethod
+from contextlib import closing
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_BACKEND = os.environ.get("NOTIFY_BACKEND", "memory")  # memory | sqlite
+NOTIFY_SQLITE_PATH = os.environ.get("NOTIFY_SQLITE_PATH") or os.path.join(tempfile.gettempdir(), "exam-shuffler-notify.db")
+NOTIFY_POLL_INTERVAL = float(os.environ.get("NOTIFY_POLL_INTERVAL", "0.25"))  # Seconds between SQLite polls
+NOTIFY_RETENTION = float(os.environ.get("NOTIFY_RETENTION", "300"))  # Seconds published messages are kept
+
+
+class NotificationBus(ABC):
+    """Keeps the WebSockets connected to this process and delivers messages to them."""
+
+    def __init__(self):
+        self.connections = {}  # job_id -> WebSocket connected to this process
+        self.remote_listeners = []  # Called with (job_id, message) for messages published by other processes
+
+    def on_remote_message(self, listener):
+        """Register a callback for messages published by other processes (e.g. to drop cached state)."""
+        self.remote_listeners.append(listener)
+
+    def _notify_remote_listeners(self, job_id: str, message: str):
+        for listener in self.remote_listeners:
+            try:
+                listener(job_id, message)
+            except Exception:
+                logger.exception("Notification listener failed for job %s", job_id)
+
+    def register(self, job_id: str, websocket):
+        self.connections[job_id] = websocket
+
+    def unregister(self, job_id: str, websocket=None):
+        """Forget the socket of a job (only if it is still `websocket`, when given)."""
+        if websocket is None or self.connections.get(job_id) is websocket:
+            self.connections.pop(job_id, None)
+
+    async def deliver(self, job_id: str, message: str) -> bool:
+        """Send a message to the job's socket if it is connected to this process."""
+        websocket = self.connections.get(job_id)
+        if websocket is None:
+            return False
+        try:
+            await websocket.send_text(message)
+        except Exception:
+            logger.debug("Could not deliver %r to job %s", message, job_id, exc_info=True)
+            self.unregister(job_id, websocket)
+            return False
+        return True
+
+    @abstractmethod
+    async def publish(self, job_id: str, message: str):
+        """Send a message to the job's socket, wherever it is connected."""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class MemoryBus(NotificationBus):
+    """Single-process bus: publishing is delivering."""
+
+    async def publish(self, job_id: str, message: str):
+        await self.deliver(job_id, message)
+
+
+class SQLiteBus(NotificationBus):
+    """
+    Bus shared by the workers of one host through a SQLite file.
+    Each process polls for messages newer than the last one it saw and
+    delivers those whose socket it holds.
+    """
+
+    def __init__(self, path: str = NOTIFY_SQLITE_PATH, poll_interval: float = NOTIFY_POLL_INTERVAL,
+                 retention: float = NOTIFY_RETENTION):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.last_id = 0
+        self.pruned_at = 0.0
+        self.published = set()  # Ids of messages published by this process and not yet read back
+        self.task = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _setup(self) -> int:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, "
+                "message TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    def _insert(self, job_id: str, message: str) -> int:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute("INSERT INTO messages (job_id, message, created_at) VALUES (?, ?, ?)",
+                                (job_id, message, time.time())).lastrowid
+
+    def _fetch(self, last_id: int) -> list:
+        with closing(self._connect()) as conn, conn:
+            now = time.time()
+            if now - self.pruned_at > self.retention:
+                conn.execute("DELETE FROM messages WHERE created_at < ?", (now - self.retention,))
+                self.pruned_at = now
+            return conn.execute("SELECT id, job_id, message FROM messages WHERE id > ? ORDER BY id",
+                                (last_id,)).fetchall()
+
+    async def start(self):
+        # Only messages published from now on are delivered
+        self.last_id = await asyncio.to_thread(self._setup)
+        self.task = asyncio.create_task(self.subscribe())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def publish(self, job_id: str, message: str):
+        message_id = await asyncio.to_thread(self._insert, job_id, message)
+        if message_id > self.last_id:  # Not read back by subscribe() yet
+            self.published.add(message_id)
+
+    async def subscribe(self):
+        while True:
+            try:
+                rows = await asyncio.to_thread(self._fetch, self.last_id)
+            except Exception:
+                logger.exception("Could not read notifications from %s", self.path)
+                rows = []
+            for message_id, job_id, message in rows:
+                self.last_id = message_id
+                if message_id in self.published:
+                    self.published.discard(message_id)
+                else:
+                    self._notify_remote_listeners(job_id, message)
+                await self.deliver(job_id, message)
+            await asyncio.sleep(self.poll_interval)
+
+
+class GroupSocket:
+    """
+    Stands in for the WebSocket of one job of a group: the bus delivers the job's messages
+    to it and it forwards them to the group's WebSocket as JSON tagged with the job id,
+    e.g. {"job_id": ..., "type": "done"} or {"job_id": ..., "type": "progress", "questions": 3, ...}.
+    """
+
+    def __init__(self, websocket, job_id: str):
+        self.websocket = websocket
+        self.job_id = job_id
+
+    async def send_text(self, message: str):
+        payload = json.loads(message) if message.startswith("{") else {"type": message}
+        await self.websocket.send_text(json.dumps({"job_id": self.job_id, **payload}))
+
+
+def create_bus(backend: str = NOTIFY_BACKEND) -> NotificationBus:
+    if backend == "memory":
+        return MemoryBus()
+    if backend == "sqlite":
+        return SQLiteBus()
+    raise ValueError(f"Unknown NOTIFY_BACKEND: {backend}")
+
+
+bus = create_bus()
+metrics.gauge("websocket_connections", "Job WebSockets connected to this process", lambda: len(bus.connections))
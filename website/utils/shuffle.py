@@ -0,0 +1,39 @@
+import random
+import re
+import secrets
+
+SEED_PATTERN = re.compile(r"^[0-9a-f]{1,16}$")
+
+
+def new_seed() -> str:
+    """Return a fresh seed for a practice attempt."""
+    return secrets.token_hex(4)
+
+
+def valid_seed(seed) -> bool:
+    return isinstance(seed, str) and bool(SEED_PATTERN.match(seed))
+
+
+def answer_permutation(seed: str, question_index: int, answer_count: int) -> list:
+    """Permutation of answer indexes for one question, reproducible from the seed alone."""
+    order = list(range(answer_count))
+    random.Random(f"{seed}:{question_index}").shuffle(order)
+    return order
+
+
+def shuffle_questions(questions: list, seed: str, start: int = 0) -> list:
+    """
+    Return questions with their answers permuted for this attempt. `start` is the index of
+    the first question in the exam, so any page of questions gets the same order as the whole exam.
+    Only lists of references are rebuilt: the stored (possibly cached) questions are not modified.
+    """
+    shuffled_questions = []
+    for index, question in enumerate(questions, start=start):
+        answers = question.get("answers") or []
+        order = answer_permutation(seed, index, len(answers))
+        shuffled = dict(question)
+        shuffled["answers"] = [answers[i] for i in order]
+        if isinstance(question.get("correct_index"), int) and question["correct_index"] in order:
+            shuffled["correct_index"] = order.index(question["correct_index"])
+        shuffled_questions.append(shuffled)
+    return shuffled_questions
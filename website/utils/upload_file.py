@@ -1,15 +1,85 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+import asyncio
 import hashlib
+import os
+
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
+MAX_REQUEST_OVERHEAD = 64 * 1024  # Multipart boundaries and headers around the file
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "6"))  # PDFs accepted by one /upload-pdfs request
+CHUNK_SIZE = 256 * 1024  # Bytes read, hashed and written per step
+PDF_MAGIC = b"%PDF-"
+
+FILE_TOO_LARGE = "File size exceeds the maximum limit of 10MB"
+NOT_A_PDF = "Only PDF files are allowed"
 
 class FileUpload():
-    def __init__(self, file_bytes, file_size:int):
-        self.file = file_bytes
-        self.file_size = file_size
-        self.file_hash = None
+    def __init__(self):
+        self.file_size = 0
+        self.file_hash = None  # SHA-256 of the stored file, set by stream_to_file
 
-    async def hash_file(self):
+    async def stream_to_file(self, upload, path: str):
+        """
+        Copy an UploadFile to `path` chunk by chunk, hashing as it goes.
+        Stops at the first chunk that is not a PDF or that crosses MAX_FILE_SIZE,
+        so at most one chunk is held in memory.
+        Returns:
+            str: Error message, or None when the whole file was stored.
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        out = await asyncio.to_thread(open, path, "wb")
         try:
-            hashed_file  = hashlib.sha256(self.file).hexdigest()
-        except Exception as e:
-            return None
-        
-        return hashed_file
\ No newline at end of file
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and not chunk.startswith(PDF_MAGIC):
+                    return NOT_A_PDF
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    return FILE_TOO_LARGE
+                # hashlib releases the GIL on large buffers, so both run off the event loop
+                await asyncio.to_thread(lambda: (hasher.update(chunk), out.write(chunk)))
+        finally:
+            await asyncio.to_thread(out.close)
+        self.file_size = size
+        self.file_hash = hasher.hexdigest()
+        return None if size else "File is empty"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject oversized uploads while the body is still arriving, before the
+    multipart parser has buffered it. Checks Content-Length up front and
+    counts the streamed bytes for chunked requests.
+    """
+
+    def __init__(self, app, paths, max_body_size: int = MAX_FILE_SIZE + MAX_REQUEST_OVERHEAD):
+        self.app = app
+        self.paths = set(paths)
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse(status_code=413, content={"detail": FILE_TOO_LARGE})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    raise HTTPException(status_code=413, detail=FILE_TOO_LARGE)
+            return message
+
+        await self.app(scope, limited_receive, send)
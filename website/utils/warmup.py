@@ -0,0 +1,31 @@
+import asyncio
+import logging
+
+from ..firebase import init_firebase
+from ..firebase.storage import run_io
+from ..gimini.runner import get_client
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_clients() -> dict:
+    """
+    Initialize the Firebase app and the Gemini client off the event loop.
+    Failures are reported instead of raised, so a credential hiccup does not stop the app;
+    the next call (or the next /ready probe) tries again.
+    Returns:
+        dict: "ok" or the error message per client.
+    """
+    async def check(name, init):
+        try:
+            await init()
+            return name, "ok"
+        except Exception as e:
+            logger.warning("Could not initialize %s: %s", name, e)
+            return name, f"error: {type(e).__name__}"  # Details are in the log
+
+    results = await asyncio.gather(
+        check("firebase", lambda: run_io(init_firebase)),
+        check("gemini", lambda: asyncio.to_thread(get_client)),
+    )
+    return dict(results)